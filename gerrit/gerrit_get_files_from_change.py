@@ -2,10 +2,22 @@
 find all changed files of every changes in gerrit
 
 author: s1mple-child
+
+Batch mode reads changes from a file or stdin, one change per line:
+    project_name branch_name change_id [revision_id]
+revision_id is 'current' if it's not given. Changes are requested concurrently over pooled connections
+and every change is printed as one json line with stats of changed files, like lines_inserted and lines_deleted.
 '''
+import argparse
 import json
 import sys
+import http_client
+from http_client import decode_json_response
 from migrate_from_gitlab_2gerrit import create_access_session, set_gerrit_port
+from worker_pool import map_in_order
+
+# number of changes requested at the same time in batch mode
+BATCH_WORKERS = 8
 
 
 # find changed files via gerrit REST API
@@ -16,10 +28,27 @@ def get_changed_files(gerrit_ip, project_name, branch_name, change_id, revision_
     :param project_name: project name of change
     :param branch_name: target branch name of change
     :param change_id: change id
-    :param revision_id: revision of change 
+    :param revision_id: revision of change
     """
     files_list = []
-    # create http request session
+    files_finding_response = find_changed_files(gerrit_ip, project_name, branch_name, change_id, revision_id)
+    for key in files_finding_response:
+        files_list.append(key)
+
+    print(files_list)
+
+
+# request files of revision via gerrit REST API
+def find_changed_files(gerrit_ip, project_name, branch_name, change_id, revision_id):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param project_name: project name of change
+    :param branch_name: target branch name of change
+    :param change_id: change id
+    :param revision_id: revision of change
+    :return: changed_files: {file path: file info of gerrit, like status, lines_inserted and lines_deleted}
+    """
+    # get pooled http request session
     http_session = create_access_session(gerrit_ip)
     # set gerrit port
     gerrit_port = set_gerrit_port(gerrit_ip)
@@ -27,13 +56,103 @@ def get_changed_files(gerrit_ip, project_name, branch_name, change_id, revision_
     # replace '/' in project_name for http request
     if '/' in project_name:
         project_name = project_name.replace('/', '%2F')
-    files_finding_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port + '/a/changes/' 
-    + project_name + '~' + branch_name + '~' + change_id + '/revisions/' + revision_id 
-    + '/files/').text.replace(')]}\'', '')
-    for key in json.loads(files_finding_response):
-        files_list.append(key)
+    files_finding_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port + '/a/changes/'
+    + project_name + '~' + branch_name + '~' + change_id + '/revisions/' + revision_id
+    + '/files/')
+    if files_finding_response.status_code != 200:
+        # gerrit responses plain text like 'Not found' with error status
+        raise ValueError(str(files_finding_response.status_code) + ' ' + files_finding_response.text.strip())
 
-    print(files_list)
+    return decode_json_response(files_finding_response)
+
+
+# read changes of batch mode, one change per line
+def read_change_triples(change_lines):
+    """
+    :param change_lines: lines like 'project_name branch_name change_id [revision_id]'
+    :return: generator of (project_name, branch_name, change_id, revision_id)
+    """
+    for line in change_lines:
+        change_fields = line.split()
+        if not change_fields or change_fields[0].startswith('#'):
+            continue
+        if len(change_fields) not in (3, 4):
+            print('Invalid change line is skipped: ' + line.strip(), file=sys.stderr)
+            continue
+        project_name, branch_name, change_id = change_fields[:3]
+        revision_id = change_fields[3] if len(change_fields) == 4 else 'current'
+        yield project_name, branch_name, change_id, revision_id
+
+
+# find changed files of many changes concurrently and write them as json lines
+def get_changed_files_in_batch(gerrit_ip, change_lines, output=sys.stdout, max_workers=BATCH_WORKERS):
+    """
+    results are written in the same order as changes, failed change has 'error' instead of 'files'
+    :param gerrit_ip: gerrit ip address
+    :param change_lines: lines like 'project_name branch_name change_id [revision_id]'
+    :param output: text stream which json lines are written to
+    :param max_workers: number of changes requested at the same time
+    """
+    if max_workers > http_client.POOL_SIZE:
+        http_client.configure_http_client(pool_size=max_workers)
+
+    def find_changed_files_of_change(change):
+        project_name, branch_name, change_id, revision_id = change
+        change_result = {'project': project_name, 'branch': branch_name, 'change_id': change_id,
+                         'revision': revision_id}
+        try:
+            changed_files = find_changed_files(gerrit_ip, project_name, branch_name, change_id, revision_id)
+        except (OSError, ValueError) as error:
+            change_result['error'] = str(error)
+            return change_result
+        change_result['files'] = [dict(file_info, file=file_path) for file_path, file_info in changed_files.items()]
+        return change_result
+
+    for change_result in map_in_order(find_changed_files_of_change, read_change_triples(change_lines), max_workers):
+        output.write(json.dumps(change_result) + '\n')
+        output.flush()
+
+
+# parse command line arguments
+def parse_arguments():
+    """
+    :return: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Find changed files of changes in Gerrit.')
+    parser.add_argument('gerrit_ip', help='gerrit ip address')
+    parser.add_argument('project_name', nargs='?', help='project name of change')
+    parser.add_argument('branch_name', nargs='?', help='target branch name of change')
+    parser.add_argument('change_id', nargs='?', help='change id')
+    parser.add_argument('revision_id', nargs='?', default='current', help='revision of change, default is current')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="file with changes, one 'project_name branch_name change_id [revision_id]' per line, "
+                        "'-' to read changes from stdin")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS,
+                        help='number of changes requested at the same time in batch mode, default is '
+                        + str(BATCH_WORKERS))
+
+    arguments = parser.parse_args()
+    if arguments.batch is None and arguments.change_id is None:
+        parser.error('project_name, branch_name and change_id are required without --batch')
+
+    return arguments
+
+
+# entry point of command line
+def main():
+    """
+    print changed files of one change, or of every change in file given by --batch as json lines
+    """
+    arguments = parse_arguments()
+    if arguments.batch == '-':
+        get_changed_files_in_batch(arguments.gerrit_ip, sys.stdin, max_workers=arguments.workers)
+    elif arguments.batch is not None:
+        with open(arguments.batch, encoding='utf-8') as changes_file:
+            get_changed_files_in_batch(arguments.gerrit_ip, changes_file, max_workers=arguments.workers)
+    else:
+        get_changed_files(arguments.gerrit_ip, arguments.project_name, arguments.branch_name, arguments.change_id,
+                          arguments.revision_id)
 
 
-get_changed_files(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
+if __name__ == '__main__':
+    main()
@@ -9,32 +9,97 @@ Step 1: export gerrit data use following command
 
 Step 2: parse json source file
 
-Step 3: write data to excel or other types of files you want
+Step 3: write data to excel, csv, parquet or sqlite, see review_info_sinks
+        or load data to sqlite store with --store, target file is queried from store, see review_info_store
+
+NOTE: requests are sent through http_client in gitlab directory, add it to PYTHONPATH before running
 '''
+import argparse
 import json
+import mmap
+import os
 import datetime
-from datetime import datetime, timedelta
+from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo
 import re
-import sys
-import pandas as pd
-import openpyxl
-import requests
-from openpyxl import load_workbook
-
-
-# parse json source file and append parsed data to a list
-def parse_json_from_file(json_file_full_path):
+from functools import lru_cache
+# heavy dependencies like openpyxl are imported when they're used, so wrong arguments are reported without loading them
+import http_client
+from http_client import get_session, decode_json_response, loads_json
+from worker_pool import map_in_order
+from review_info_sinks import SINK_TYPES, create_review_info_sink
+from review_info_store import write_report_from_store
+
+# number of REST responses kept in memory for every change requested concurrently
+# one entry per change and endpoint, comments and detail of a change are requested only once
+# so responses of finished changes are never used again and the least recently used one is dropped
+REST_RESPONSES_PER_CHANGE = 2
+
+# timezone of review time in target file and of start date and end date
+DEFAULT_TIMEZONE = 'Asia/Shanghai'
+
+# number of review rows classified and written to target together, rows of several changes are collected in one batch
+REVIEW_ROW_BATCH_SIZE = 50000
+
+# in my use case, inline messages have some specific pattern
+# inline messages pattern: [RE,G]: blablabla
+# RE means code error type about misunstanding the requirement
+# G means the severity level is normal
+# so export data also parse these inline messages and export above these two elements to separate columns
+INLINE_MESSAGE_CODE_PATTERN = re.compile('\\[(?P<problem_type>[a-zA-Z]+),(?P<severity_level>[a-zA-Z]+)\\]')
+# meaning of codes in inline message, it can be replaced by json file with the same structure
+DEFAULT_INLINE_MESSAGE_CODES = {
+    'problem_type': {
+        'RE': 'error of understanding requirement',
+        'LE': 'error of running result',
+        'CO': 'code can promote',
+        'CS': 'syntax error',
+        'CE': 'error of code instruction'
+    },
+    'severity_level': {
+        'F': 'fatal',
+        'S': 'critical',
+        'G': 'major',
+        'T': 'minor'
+    }
+}
+
+# message added by gerrit when reviewer published inline comments, e.g. 'Patch Set 2: Code-Review+1\n\n(3 comments)'
+PUBLISH_COMMENTS_MESSAGE_PATTERN = re.compile('^Patch Set ([0-9]+):.*\\([0-9]+ comments?\\)', re.DOTALL)
+
+
+# parse json source file and yield data of every change one by one
+# only one line of json file is held in memory, so memory doesn't grow with size of json file
+def parse_json_from_file(json_file_full_path, use_mmap=False):
     """
     :param json_file_full_path: full path of gerrit json file
-    :return: json_data: list of data that read from json file
+    :param use_mmap: read json file through memory map instead of buffered file reading
+    :return: generator of change data that read from json file
     """
-    json_data = []
-    # get every line of json file
     with open(json_file_full_path, 'rb') as file_handler:
-        for line in file_handler:
-            json_data.append(json.loads(line))
+        # mmap can't map an empty file
+        if use_mmap and os.fstat(file_handler.fileno()).st_size > 0:
+            with mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                yield from parse_json_lines(iter(mapped_file.readline, b''))
+        else:
+            yield from parse_json_lines(file_handler)
 
-    return json_data
+
+# convert every line of gerrit query result to json and skip lines that aren't change
+def parse_json_lines(json_lines):
+    """
+    :param json_lines: iterable of lines in json file
+    :return: generator of change data
+    """
+    for line in json_lines:
+        # skip blank lines
+        if not line.strip():
+            continue
+        change_data = loads_json(line)
+        # the last line of gerrit query result is statistics of query like {"type":"stats","rowCount":1}
+        if change_data.get('type') == 'stats':
+            continue
+        yield change_data
 
 
 # get some info from change list like project name, branch name, etc
@@ -56,318 +121,565 @@ def get_data_from_change(change_list):
 
 # get review data use gerrit REST API(https://gerrit-review.googlesource.com/Documentation/rest-api-changes.html#get-comment)
 # parse response json and create some lists for writing target excel as data source of pandas dataframe
-def find_review_data_per_change(gerrit_instance_ip_addr, change_number):
+def find_review_data_per_change(gerrit_instance_ip_addr, change_number, review_window=None):
     """
     :param gerrit_instance_ip_addr: ip address of gerrit
     :param change number: number of change 
+    :param review_window: (start, end) timestamps created in create_review_window, comments out of it are skipped
     """
     # predefined some lists and append target data to them
-    change_reviewed_files_list = []
-    change_reviewers_list = []
-    change_num_w_patch_set_num_list = []
-    change_patch_set_uploaders_list = []
-    change_reviewed_line_num_list = []
-    change_review_time_list = []
-    change_comment_messages_list = []
-    inline_message_severity_level_list = []
-    inline_message_problem_type_list = []
-
-    # we have to create valid session to request gerrit server
-    # so we need a valid user(user with admin permission is recommanded) to achieve this step
-    # create HTTP credential of this user in gerrit(Settings - HTTP Credentials)
-    gerrit_user_name = 'admin'
-    gerrit_http_cred = 'http_passwd'
-
-    # create session of user
-    session = requests.Session()
-    # auth with defined gerrit user namd and http cred
-    session.auth = (gerrit_user_name, gerrit_http_cred)
-    # request with specific change number via above API address
-    # at the beginning of response contains some extra brackets, delete them with replace
-    comment_response = session.get('http://' + gerrit_instance_ip_addr + '/a/changes/' + str(change_number) 
-                                   + '/comments').text.replace(')]}\'', '')
-    # convert response text to json
-    comment_response_json = json.loads(comment_response)
+    review_data_lists = create_review_data_lists()
+    # 'updated' of comment is UTC time string, compare it with window in the same format to skip parsing time
+    review_time_window = None
+    if review_window is not None:
+        review_time_window = tuple(datetime.fromtimestamp(timestamp, dt_timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                                   for timestamp in review_window)
+
+    # request comments of change, every change is requested only once
+    comment_response_json = fetch_change_rest_data(gerrit_instance_ip_addr, change_number, 'comments')
+    # uploaders of all patch sets of change, requested only when some comment is in window
+    patch_set_uploaders = None
     # parse json response
     # iterate key in json
     for key in comment_response_json.keys():
         for i in range(len(comment_response_json[key])):
+            # skip comment out of window, time string is compared without fraction of second
+            if review_time_window is not None and \
+                    not review_time_window[0] <= comment_response_json[key][i]['updated'][:19] <= review_time_window[1]:
+                continue
+            if patch_set_uploaders is None:
+                patch_set_uploaders = find_patch_set_uploaders(gerrit_instance_ip_addr, change_number)
             # patch set number
             patch_set_number = comment_response_json[key][i]['patch_set']
-            # find patch set uploader use patch_set_number
-            patch_set_uploader = find_patch_set_uploader(gerrit_instance_ip_addr, change_number, patch_set_number)
+            # find patch set uploader use patch_set_number, empty if patch set has no message
+            patch_set_uploader = patch_set_uploaders.get(patch_set_number, '')
             # get review data that reviewer name who commented is different with patch set uploader name
             if comment_response_json[key][i]['author']['name'] != patch_set_uploader:
-                # create some lists as source data export to excel
-                # reviewed files list
-                change_reviewed_files_list.append(key)
-                # reviewers list
-                reviewer = comment_response_json[key][i]['author']['username']
-                change_reviewers_list.append(reviewer)
-                # change number and patch set number list
-                change_num_w_patch_set_num = str(change_number) + '/' + str(patch_set_number)
-                change_num_w_patch_set_num_list.append(change_num_w_patch_set_num)
-                # patch set uploader list
-                change_patch_set_uploaders_list.append(patch_set_uploader)
-                # reviewed lines number list
-                # check 'line' in response json set empty if not exist
-                if 'line' in comment_response_json[key][i]['line']:
-                    reviewed_line_num = comment_response_json[key][i]['line']
-                else:
-                    reviewed_line_num = ''
-                change_reviewed_line_num_list.append(reviewed_line_num)
-                # find review time and append to review time list
-                # NOTE: result time format is yyyy-MM-dd:S000f (with 9 microseconds) and timezone is UTC
-                # remove microseconds before set value to raw_review_time, then change timezone to local timezone use datetime.timedelta
-                raw_review_time = datetime.strptime(comment_response_json[key][i]['updated'], '%Y-%m-%d %H:%M:%S.000%f').replace(microsecond=0)
-                # change raw_review_time timezone to local timezone
-                local_review_time = raw_review_time + timedelta(hours=8)
-                change_review_time_list.append(local_review_time)
-                # comment messages list
-                comment_message = comment_response_json[key][i]['message']
-                change_comment_messages_list.append(comment_message)
-                # in my use case, inline messages have some specific pattern
-                # inline messages pattern: [RE,G]: blablabla
-                # RE means code error type about misunstanding the requirement 
-                # G means the severity level is normal
-                # so export data also parse these inline messages and export above these two elements to separate columns
-                inline_message_severity_level, inline_message_problem_type = parse_inline_messages(comment_message)
-                inline_message_severity_level_list.append(inline_message_severity_level)
-                inline_message_problem_type_list.append(inline_message_problem_type)
+                # NOTE: review time format is yyyy-MM-dd HH:mm:ss.SSSSSSSSS (with 9 digits of fraction) and timezone is UTC
+                # it's kept as raw string and converted to local timezone in write_result_lists_to_target
+                # file level comments have no line number
+                append_review_comment(review_data_lists, key, comment_response_json[key][i]['author']['username'],
+                                      change_number, patch_set_number, patch_set_uploader,
+                                      comment_response_json[key][i].get('line', ''),
+                                      comment_response_json[key][i]['updated'], comment_response_json[key][i]['message'])
     
-    return (change_reviewed_files_list, change_reviewers_list, change_num_w_patch_set_num_list, change_patch_set_uploaders_list, 
-            change_reviewed_line_num_list, change_review_time_list, change_comment_messages_list, inline_message_severity_level_list, 
-            inline_message_problem_type_list)
+    return review_data_lists
+
+
+# get review data from change data in gerrit json file without gerrit REST API
+# json file exported with '--comments --patch-sets' contains uploader and inline comments of every patch set
+# inline comments in json file have no time, the time of message that published them is used as review time
+def find_review_data_in_change_data(gerrit_instance_ip_addr, change_data, review_window=None):
+    """
+    :param gerrit_instance_ip_addr: ip address of gerrit, use REST API as fallback when review time can't be found, None to disable
+    :param change_data: data of change read from json file
+    :param review_window: (start, end) timestamps created in create_review_window, comments out of it are skipped
+    :return: same lists as find_review_data_per_change
+    """
+    change_number = change_data['number']
+    review_data_lists = create_review_data_lists()
+    publish_times = find_comment_publish_times(change_data)
+
+    for patch_set in change_data['patchSets']:
+        patch_set_number = patch_set['number']
+        patch_set_uploader = patch_set.get('uploader', {}).get('name', '')
+        # comments of patch set can't be earlier than its creation
+        if review_window is not None and patch_set['createdOn'] > review_window[1]:
+            continue
+        for comment in patch_set.get('comments', []):
+            reviewer = comment.get('reviewer', {})
+            # get review data that reviewer name who commented is different with patch set uploader name
+            if reviewer.get('name') == patch_set_uploader:
+                continue
+            review_timestamps = publish_times.get((patch_set_number, reviewer.get('username')), [])
+            if len(review_timestamps) != 1 and gerrit_instance_ip_addr:
+                # reviewer published comments of this patch set several times or message not in json file
+                # review time of every comment can't be decided, request this change via REST API
+                return find_review_data_per_change(gerrit_instance_ip_addr, change_number, review_window)
+            # use the latest publish time, or creation time of patch set when no message found
+            review_timestamp = review_timestamps[-1] if review_timestamps else patch_set['createdOn']
+            if review_window is not None and not review_window[0] <= review_timestamp <= review_window[1]:
+                continue
+            # unix timestamp is converted to local timezone in write_result_lists_to_target like time from REST API
+            append_review_comment(review_data_lists, comment['file'], reviewer.get('username', ''), change_number,
+                                  patch_set_number, patch_set_uploader, comment.get('line', ''), review_timestamp,
+                                  comment['message'])
+
+    return review_data_lists
+
+
+# find time of messages that published inline comments in change
+# gerrit adds message like 'Patch Set 2: Code-Review+1\n\n(3 comments)' when reviewer published inline comments
+def find_comment_publish_times(change_data):
+    """
+    :param change_data: data of change read from json file
+    :return: publish_times: dict maps (patch set number, reviewer username) to list of message timestamps
+    """
+    publish_times = {}
+    for message in change_data.get('comments', []):
+        check_pattern_result = PUBLISH_COMMENTS_MESSAGE_PATTERN.search(message['message'])
+        if check_pattern_result is not None:
+            publish_key = (int(check_pattern_result.group(1)), message.get('reviewer', {}).get('username'))
+            publish_times.setdefault(publish_key, []).append(message['timestamp'])
+
+    return publish_times
+
+
+# convert start date and end date of report to window of unix timestamps
+# window is used to skip changes and comments that can't be written to target before requesting gerrit
+def create_review_window(start_date, end_date, timezone=DEFAULT_TIMEZONE):
+    """
+    :param start_date: start date, format is YYYY-mm-dd
+    :param end_date: end date, format is YYYY-mm-dd
+    :param timezone: IANA timezone of two dates, like 'Asia/Shanghai'
+    :return: review_window: (start, end) timestamps, both ends included
+    """
+    return tuple(int(datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=ZoneInfo(timezone)).timestamp())
+                 for date in (start_date, end_date))
+
+
+# create lists that find_review_data_per_change returns
+def create_review_data_lists():
+    """
+    :return: review_data_lists: reviewed files, reviewers, change number with patch set number, patch set uploaders,
+             reviewed lines number, review time and comment messages lists
+    """
+    return tuple([] for _ in range(7))
+
+
+# append one inline comment to lists created in create_review_data_lists
+def append_review_comment(review_data_lists, reviewed_file, reviewer, change_number, patch_set_number,
+                          patch_set_uploader, reviewed_line_num, review_time, comment_message):
+    """
+    :param review_data_lists: lists created in create_review_data_lists
+    :param reviewed_file: file that comment belongs to
+    :param reviewer: username of reviewer
+    :param change_number: number of change
+    :param patch_set_number: number of patch set
+    :param patch_set_uploader: uploader of patch set
+    :param reviewed_line_num: line number of comment, empty for file level comment
+    :param review_time: raw review time, UTC time string of REST API or unix timestamp of json file
+    :param comment_message: message of comment
+    """
+    (change_reviewed_files_list, change_reviewers_list, change_num_w_patch_set_num_list, change_patch_set_uploaders_list,
+     change_reviewed_line_num_list, change_review_time_list, change_comment_messages_list) = review_data_lists
+
+    change_reviewed_files_list.append(reviewed_file)
+    change_reviewers_list.append(reviewer)
+    # change number and patch set number list
+    change_num_w_patch_set_num_list.append(str(change_number) + '/' + str(patch_set_number))
+    change_patch_set_uploaders_list.append(patch_set_uploader)
+    change_reviewed_line_num_list.append(reviewed_line_num)
+    change_review_time_list.append(review_time)
+    # codes in comment message are classified in write_result_lists_to_target together with other comments
+    change_comment_messages_list.append(comment_message)
 
 
 # write review data with several lists created in find_review_data_per_change to target file
 # we also use date as parameters to filter data between two dates and write these data to target
-def write_result_lists_to_target(start_date, end_date, reviewed_date_list, patch_set_num_list, 
-reviewed_messages_list, reviewed_file_list, line_num_reviewed_file_list, liline_message_problem_type_list, 
-inline_message_severity_level_list, change_status, patch_set_uploader_list, 
-reviewers_list, project_name, branch_name, target_file_full_path):
-    # the format of start_date and end_date is YYYY-mm-dd
-    # convert two string date values to datetime format
-    formatted_start_date = datetime.strptime(start_date, '%Y-%m-%d')
-    formatted_end_date = datetime.strptime(end_date, '%Y-%m-%d')
-
-    # because all given lists have same length, select one of them and itearate all given lists
-    for i, _ in enumerate(reviewed_file_list):
-        if formatted_start_date <= reviewed_date_list[i] <= formatted_end_date:
-            print('Writing review data to target excel which sheet name is Review Info. The ref is ' + patch_set_num_list[i])
-            # create pandas dataframe
-            df = pd.DataFrame({'review message': [reviewed_messages_list[i]],
-                                'review date': [reviewed_date_list[i]],
-                                'reviewed file': [reviewed_file_list[i]],
-                                'line number of reviewed file': [line_num_reviewed_file_list[i]],
-                                'inline message problem type': [liline_message_problem_type_list[i]],
-                                'inline message severity level': [inline_message_severity_level_list[i]],
-                                'change status': [change_status],
-                                'patch set uploader': [patch_set_uploader_list[i]],
-                                'reviewer': [reviewers_list[i]],
-                                'project name': [project_name],
-                                'branch name': [branch_name],
-                                'change number/patch set number': [patch_set_num_list[i]]
-                                })
-            # load workbook from given target file full path
-            wb = openpyxl.load_workbook(target_file_full_path, read_only=True)
-            if 'Review Info' in wb.sheetnames:
-                # use concat to concreate existed data and new data
-                source_df = pd.DataFrame(pd.read_excel(target_file_full_path, sheet_name='Review Info'))
-                target_df = pd.concat([source_df, df])
+# review time, date window and codes of inline messages are handled for the whole batch at once
+def write_result_lists_to_target(start_date, end_date, review_data_batch, review_info_sink, inline_message_codes=None,
+                                 timezone=DEFAULT_TIMEZONE):
+    """
+    :param start_date: start date, format is YYYY-mm-dd, None to write reviews of all dates
+    :param end_date: end date, format is YYYY-mm-dd, None to write reviews of all dates
+    :param review_data_batch: list of (review data returned by collect_review_data_of_change, exported_until)
+                              exported_until is 'lastUpdated' timestamp of last export of project, reviews not later
+                              than it are already in target, None if project not exported before
+    :param review_info_sink: sink created by create_review_info_sink
+    :param inline_message_codes: meaning of codes in inline message, DEFAULT_INLINE_MESSAGE_CODES if it's None
+    :param timezone: IANA timezone of review time in target, start date and end date
+    """
+    import numpy as np
+    import pandas as pd
+
+    # join lists of all changes, values of change like project name are repeated for every comment
+    batch_columns = [[] for _ in range(10)]
+    exported_until_list = []
+    for change_review_data, exported_until in review_data_batch:
+        comments_count = len(change_review_data[3])
+        for column_index, column_values in enumerate(change_review_data):
+            if column_index < 3:
+                batch_columns[column_index].extend([column_values] * comments_count)
             else:
-                target_df = df
-            # write new dataframe object to target file
-            with pd.ExcelWriter(target_file_full_path, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-                target_df.to_excel(writer, index=False, sheet_name='Review Info')
+                batch_columns[column_index].extend(column_values)
+        exported_until_list.extend([np.nan if exported_until is None else exported_until] * comments_count)
+    (project_name_list, branch_name_list, change_status_list, reviewed_file_list, reviewers_list, patch_set_num_list,
+     patch_set_uploader_list, line_num_reviewed_file_list, raw_review_time_list,
+     reviewed_messages_list) = batch_columns
+
+    review_timestamps = convert_review_times_to_timestamps(raw_review_time_list)
+    # NaN of project not exported before is never compared as true
+    in_window_mask = ~(review_timestamps <= np.array(exported_until_list, dtype='float64'))
+    if start_date is not None:
+        # the format of start_date and end_date is YYYY-mm-dd, both dates are midnight in given timezone
+        window_start, window_end = create_review_window(start_date, end_date, timezone)
+        in_window_mask &= (review_timestamps >= window_start) & (review_timestamps <= window_end)
+    # target file has local time without timezone, excel can't save time with timezone
+    local_review_times = pd.to_datetime(review_timestamps, unit='s', utc=True).tz_convert(timezone) \
+        .tz_localize(None).to_pydatetime()
+    # classify comment messages of all changes in batch at once
+    inline_message_severity_level_list, inline_message_problem_type_list = classify_inline_messages(
+        reviewed_messages_list, inline_message_codes)
+
+    written_rows_indexes = np.flatnonzero(in_window_mask)
+    for i in written_rows_indexes:
+        # append row to sink, the order of values is the same as REVIEW_INFO_COLUMNS
+        review_info_sink.append_row([reviewed_messages_list[i], local_review_times[i], reviewed_file_list[i],
+                                     line_num_reviewed_file_list[i], inline_message_problem_type_list[i],
+                                     inline_message_severity_level_list[i], change_status_list[i],
+                                     patch_set_uploader_list[i], reviewers_list[i], project_name_list[i],
+                                     branch_name_list[i], patch_set_num_list[i]])
+    # print once per batch instead of once per row, printing every row is slower than writing it to csv or sqlite
+    print('Writing ' + str(len(written_rows_indexes)) + ' review rows of ' + str(len(review_data_batch))
+          + ' changes to target.')
+
+
+# convert raw review times to unix timestamps at once
+def convert_review_times_to_timestamps(raw_review_times):
+    """
+    :param raw_review_times: list of UTC time strings of REST API and unix timestamps of json file
+    :return: review_timestamps: numpy array of seconds since epoch, fraction of second removed
+    """
+    import pandas as pd
+
+    raw_review_times = pd.Series(raw_review_times, dtype='object')
+    # time strings become NaN here and are parsed separately
+    review_timestamps = pd.to_numeric(raw_review_times, errors='coerce')
+    time_string_mask = review_timestamps.isna()
+    if time_string_mask.any():
+        review_times = pd.to_datetime(raw_review_times[time_string_mask], utc=True, format='ISO8601')
+        review_timestamps[time_string_mask] = (review_times - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+
+    return review_timestamps.to_numpy(dtype='int64')
 
 
 # the entrance of file
-def parse_n_write_data_to_target(json_file_full_path, target_file_full_path, gerrit_instance_ip_addr, start_date, end_date):
+def parse_n_write_data_to_target(json_file_full_path, target_file_full_path, gerrit_instance_ip_addr, start_date, end_date,
+                                 use_mmap=False, max_workers=1, offline=False, state_file_full_path=None,
+                                 sink_type='excel', inline_message_codes=None, timezone=DEFAULT_TIMEZONE):
     """
     :param: json_file_full_path: full path of gerrit source json file
     :param: target_file_full_path: full path of target file
     :param: gerrit_instance_ip_addr: gerrit ip address
-    :param: start_date: start date
-    :param: end_date: end date
-    """
-    source_gerrit_json_data = parse_json_from_file(json_file_full_path)
-    for index in range(len(source_gerrit_json_data) - 1):
-        # get data of change
-        change_data = source_gerrit_json_data[index]
-        project_name = get_data_from_change(change_data)[0]
-        branch_name = get_data_from_change(change_data)[1]
-        change_status = get_data_from_change(change_data)[2]
-        change_number = get_data_from_change(change_data)[3]
-
-        # get all lists of change
-        patch_set_data = source_gerrit_json_data[index]['patchSets']
-        for _, key in enumerate(patch_set_data):
-            if 'comments' in key:
-                change_reviewed_files_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[0]
-                change_reviewers_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[1]
-                change_patch_set_num_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[2]
-                change_patch_set_uploaders_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[3]
-                change_reviewed_line_num_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[4]
-                change_review_time_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[5]
-                change_comment_messages_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[6]
-                inline_message_severity_level_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[7]
-                inline_message_problem_type_list = find_review_data_per_change(gerrit_instance_ip_addr, change_number)[8]
-                # write results to target file
-                write_result_lists_to_target(start_date, end_date, change_review_time_list, change_patch_set_num_list, 
-                change_comment_messages_list, change_reviewed_files_list, change_reviewed_line_num_list, 
-                inline_message_problem_type_list, inline_message_severity_level_list, change_status, 
-                change_patch_set_uploaders_list, change_reviewers_list, project_name, branch_name, target_file_full_path)
-                break
+    :param: start_date: start date, None to export reviews of all dates
+    :param: end_date: end date, None to export reviews of all dates
+    :param: use_mmap: read gerrit source json file through memory map
+    :param: max_workers: number of changes requested from gerrit concurrently
+    :param: offline: build review data from gerrit source json file, gerrit is only requested as fallback
+    :param: state_file_full_path: full path of state file of incremental export, None to export all changes
+    :param: sink_type: type of target file, one of SINK_TYPES
+    :param: inline_message_codes: meaning of codes in inline message, DEFAULT_INLINE_MESSAGE_CODES if it's None
+    :param: timezone: IANA timezone of start date, end date and review time in target
+    """
+    # watermark of every project saved by last export, it is updated only after target file written
+    export_state = load_export_state(state_file_full_path)
+    new_export_state = dict(export_state)
+    review_window = None
+    if start_date is not None:
+        review_window = create_review_window(start_date, end_date, timezone)
+    # every worker thread needs its own connection
+    if max_workers > http_client.POOL_SIZE:
+        http_client.configure_http_client(pool_size=max_workers)
+    configure_rest_response_cache(max_workers)
+    review_info_sink = create_review_info_sink(sink_type, target_file_full_path)
+    # review data of several changes are written together, see REVIEW_ROW_BATCH_SIZE
+    review_data_batch = []
+    batch_rows_count = 0
+    # changes are read one by one, only changes that have comments in window and updated since last export need to request gerrit
+    changes_with_comments = select_changes_to_export(parse_json_from_file(json_file_full_path, use_mmap),
+                                                     export_state, review_window)
+    # 'lastUpdated' of written changes, watermark of project is moved only by them
+    batch_last_updated = []
+    # REST requests of changes run in worker threads, results come back in the same order as json file
+    # only this thread writes target file
+    for change_last_updated, change_review_data in map_in_order(
+            lambda change_data: (change_data['lastUpdated'],
+                                 collect_review_data_of_change(gerrit_instance_ip_addr, change_data, offline,
+                                                               review_window)),
+            changes_with_comments, max_workers):
+        # reviews of changed change which already exported by last export are skipped
+        review_data_batch.append((change_review_data, export_state.get(change_review_data[0])))
+        batch_last_updated.append(change_last_updated)
+        batch_rows_count += len(change_review_data[3])
+        # write results to target file
+        if batch_rows_count >= REVIEW_ROW_BATCH_SIZE:
+            write_result_lists_to_target(start_date, end_date, review_data_batch, review_info_sink,
+                                         inline_message_codes, timezone)
+            update_export_state(new_export_state, review_data_batch, batch_last_updated, review_window)
+            review_data_batch = []
+            batch_last_updated = []
+            batch_rows_count = 0
+    if review_data_batch:
+        write_result_lists_to_target(start_date, end_date, review_data_batch, review_info_sink,
+                                     inline_message_codes, timezone)
+        update_export_state(new_export_state, review_data_batch, batch_last_updated, review_window)
+
+    # write target file once after all changes parsed
+    review_info_sink.close()
+    save_export_state(state_file_full_path, new_export_state)
+
+
+# move watermark of projects after reviews of changes written to target
+# watermark never passes end of window, reviews later than it are exported by next export with later window
+def update_export_state(new_export_state, review_data_batch, batch_last_updated, review_window=None):
+    """
+    :param new_export_state: dict maps project name to watermark, it's saved when export finished
+    :param review_data_batch: review data batch written by write_result_lists_to_target
+    :param batch_last_updated: 'lastUpdated' of every change in batch
+    :param review_window: (start, end) timestamps created in create_review_window, None if no window
+    """
+    for (change_review_data, _), change_last_updated in zip(review_data_batch, batch_last_updated):
+        project_name = change_review_data[0]
+        if review_window is not None:
+            change_last_updated = min(change_last_updated, review_window[1])
+        new_export_state[project_name] = max(new_export_state.get(project_name, 0), change_last_updated)
+
+
+# select changes need to export from changes in json file
+# changes without comments or not updated since last export of its project are skipped before any request
+def select_changes_to_export(changes, export_state, review_window=None):
+    """
+    :param changes: iterable of change data read from json file
+    :param export_state: dict maps project name to watermark of last export
+    :param review_window: (start, end) timestamps created in create_review_window
+    :return: generator of change data need to export
+    """
+    for change_data in changes:
+        project_name = change_data['project']
+        change_last_updated = change_data['lastUpdated']
+        project_watermark = export_state.get(project_name, 0)
+        if change_last_updated <= project_watermark:
+            continue
+        # no comment can be later than last update of change
+        if review_window is not None and change_last_updated < review_window[0]:
+            continue
+        # comments of patch set can't be earlier than its creation
+        if any('comments' in patch_set and (review_window is None or patch_set['createdOn'] <= review_window[1])
+               for patch_set in change_data['patchSets']):
+            yield change_data
+
+
+# load watermark of every project from state file of incremental export
+def load_export_state(state_file_full_path):
+    """
+    :param state_file_full_path: full path of state file, None or not existed file means nothing exported before
+    :return: export_state: dict maps project name to watermark, reviews not later than it were exported before
+    """
+    if state_file_full_path is None or not os.path.exists(state_file_full_path):
+        return {}
+    with open(state_file_full_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# save watermark of every project to state file of incremental export
+def save_export_state(state_file_full_path, export_state):
+    """
+    :param state_file_full_path: full path of state file, nothing saved if it is None
+    :param export_state: dict maps project name to watermark
+    """
+    if state_file_full_path is None:
+        return
+    # write to temporary file then rename it, so state file is never left half written
+    temp_file_full_path = state_file_full_path + '.tmp'
+    with open(temp_file_full_path, 'w', encoding='utf-8') as f:
+        json.dump(export_state, f, indent=4, sort_keys=True)
+    os.replace(temp_file_full_path, state_file_full_path)
+
+
+# get data of change and request all review data of this change from gerrit
+def collect_review_data_of_change(gerrit_instance_ip_addr, change_data, offline=False, review_window=None):
+    """
+    :param gerrit_instance_ip_addr: ip address of gerrit
+    :param change_data: data of change read from json file
+    :param offline: get review data from change data, gerrit is only requested as fallback
+    :param review_window: (start, end) timestamps created in create_review_window
+    :return: project name, branch name, change status and all lists created in find_review_data_per_change
+    """
+    project_name, branch_name, change_status, change_number = get_data_from_change(change_data)
+    # REST API also returns comments posted after json file was dumped, watermark of project doesn't cover them
+    # they are skipped here and exported by next export with newer json file, otherwise they are written twice
+    if review_window is None:
+        review_window = (0, change_data['lastUpdated'])
+    else:
+        review_window = (review_window[0], min(review_window[1], change_data['lastUpdated']))
+    if offline:
+        review_data_lists = find_review_data_in_change_data(gerrit_instance_ip_addr, change_data, review_window)
+    else:
+        review_data_lists = find_review_data_per_change(gerrit_instance_ip_addr, change_number, review_window)
+
+    return (project_name, branch_name, change_status) + review_data_lists
+
+
+# request gerrit REST API of change and convert response to json
+# it's called through fetch_change_rest_data, which memoizes responses of changes in flight
+def request_change_rest_data(gerrit_instance_ip_addr, change_number, endpoint):
+    """
+    :param gerrit_instance_ip_addr: ip address of gerrit
+    :param change_number: number of change
+    :param endpoint: endpoint under change, like 'comments' or 'detail'
+    :return: response json of endpoint
+    """
+    # we have to create valid session to request gerrit server
+    # so we need a valid user(user with admin permission is recommanded) to achieve this step
+    # create HTTP credential of this user in gerrit(Settings - HTTP Credentials)
+    gerrit_user_name = 'admin'
+    gerrit_http_cred = 'http_passwd'
+
+    # get pooled session of user, connections are kept alive between requests
+    # auth with defined gerrit user namd and http cred
+    session = get_session(gerrit_instance_ip_addr, (gerrit_user_name, gerrit_http_cred))
+    # request with specific change number via API address
+    # at the beginning of response contains some extra brackets, they are removed in decode_json_response
+    rest_response = session.get('http://' + gerrit_instance_ip_addr + '/a/changes/' + str(change_number)
+                                + '/' + endpoint)
+
+    return decode_json_response(rest_response)
+
+
+# memoized request_change_rest_data, it's created again by configure_rest_response_cache
+fetch_change_rest_data = lru_cache(maxsize=REST_RESPONSES_PER_CHANGE)(request_change_rest_data)
+
+
+# size REST response cache for number of changes requested concurrently, cached responses are dropped
+def configure_rest_response_cache(max_workers):
+    """
+    :param max_workers: number of changes requested from gerrit concurrently
+    """
+    global fetch_change_rest_data
+    fetch_change_rest_data = lru_cache(maxsize=REST_RESPONSES_PER_CHANGE * max_workers)(request_change_rest_data)
 
 
 # find every patch set uploader of change
 # because other users can rebase or cherry pick which change is not belong to 'himself/herself'
 # this will make difference between patch set uploader and owner of a change
 # we will request via another API(https://gerrit-review.googlesource.com/Documentation/rest-api-changes.html#get-change-detail)
-def find_patch_set_uploader(gerrit_instance_ip_addr, change_number, patch_set_number):
+# messages of change are walked only once and uploaders of all patch sets are indexed by patch set number
+def find_patch_set_uploaders(gerrit_instance_ip_addr, change_number):
     """
     :param gerrit_instance_ip_addr: ip address of gerrit
     :param change_number: number of change
-    :param patch_set_number: number of patchset
-    :return: patch_set_uploader: uploader of patchset
+    :return: patch_set_uploaders: dict maps patch set number to its uploader
     """
-    gerrit_user_name = 'admin'
-    gerrit_http_cred = 'http_passwd'
-    # request via API
-    session = requests.Session()
-    session.auth = (gerrit_user_name, gerrit_http_cred)
-    change_details_response = session.get('http://' + gerrit_instance_ip_addr + '/a/changes/' 
-                                          + str(change_number) + '/detail').text.replace(')]}\'', '')
-    change_details_response_json = json.loads(change_details_response)
+    # request via API, detail of change is shared by all comments of this change
+    change_details_response_json = fetch_change_rest_data(gerrit_instance_ip_addr, change_number, 'detail')
 
+    patch_set_uploaders = {}
+    untagged_patch_set_uploaders = {}
     # the patch set uploader located in messages of response json
-    for j in range(len(change_details_response_json['messages'])):
-        # compare patch set number in response json with patch_set_number
-        if change_details_response_json['messages'][j]['_revision_number'] == patch_set_number and 'tag' \
-            in change_details_response_json['messages'][j]:
-            # we regard a tag that conatins 'gerrit:newPatchSet' as the first record of every patch set
-            if 'gerrit:newPatchSet' in change_details_response_json['messages'][j]['tag']:
-                # get patch set uploader
-                patch_set_uploader = change_details_response_json['messages'][j]['author']['name']
-
-    return patch_set_uploader
-
-
-# parse inline messages: find specific codes in every inline message and convert these codes to its details
-def parse_inline_messages(inline_message):
-    """
-    :param inline_message: inline message
-    :return: actually_mean_severity_level: the complete meaning of severity level
-    :return: actually_mean_problem_type: the complete meaning of problem type
-    """
-    # set inline message pattern and check if inline message is corresponding its pattern
-    re_pattern = '\\[([a-zA-Z]+),([a-zA-Z]+)\\]'
-    check_pattern_result = re.search(re_pattern, inline_message)
-
-    if check_pattern_result is not None:
-        problem_type = check_pattern_result.group(1)
-        severity_level = check_pattern_result.group(2)
-        if problem_type == 'RE':
-            actually_mean_problem_type = 'error of understanding requirement'
-        elif problem_type == 'LE':
-            actually_mean_problem_type = 'error of running result'
-        elif problem_type == 'CO':
-            actually_mean_problem_type = 'code can promote'
-        elif problem_type == 'CS':
-            actually_mean_problem_type = 'syntax error'
-        elif problem_type == 'CE':
-            actually_mean_problem_type = 'error of code instruction'
-
-        if severity_level == 'F':
-            actually_mean_severity_level = 'fatal'
-        elif severity_level == 'S':
-            actually_mean_severity_level = 'critical'
-        elif severity_level == 'G':
-            actually_mean_severity_level = 'major'
-        elif severity_level == 'T':
-            actually_mean_severity_level = 'minor'
-
-    return actually_mean_severity_level, actually_mean_problem_type
-
-
-# insert index number in first column and set border in target file
-def write_index_n_set_border(target_file_full_path):
-    """
-    :param target_file_full_path: full path of target file
-    """
-    full_df = pd.DataFrame(pd.read_excel(target_file_full_path, sheet_name='Review Info'))
-    full_df.index += 1
-    with pd.ExcelWriter(target_file_full_path, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-        full_df.style.set_properties(**{'text-align': 'left', 'border-color': 'black', 'border-width': '1px', 
-        'border-style': 'solid'}).to_excel(writer, index_label='Index', sheet_name='Review Info')
-
-
-# set width of all columns
-def set_columns_width(target_file_full_path):
-    """
-    :param target_file_full_path: full path of target file
-    """
-    wb = load_workbook(filename=target_file_full_path)
-    for sheet_name in wb.sheetnames:
-        for col in wb[sheet_name].columns:
-            # find title of every column
-            column = col[0].column_letter
-            if sheet_name == 'Review Info':
-                # set column to a specific width number
-                if column == 'A':
-                    wb[sheet_name].column_dimensions[column].width = 5
-                elif column in('B', 'D'):
-                    wb[sheet_name].column_dimensions[column].width = 55
-                elif column in ('E', 'G'):
-                    wb[sheet_name].column_dimensions[column].width = 10
-                elif column in ('F', 'H', 'I', 'J'):
-                    wb[sheet_name].column_dimensions[column].width = 15
-                else:
-                    wb[sheet_name].column_dimensions[column].width = 23
-    """
-    Method2: set column width depend on the longest width of cell
-    for col in wb[sheet_name].columns:
-        max_width = 20
-        adjusted_width = 0
-        column = col[0].column_letter
-        for cell in col:
-            print(str(cell.value) + ': ' + str(len(str(cell.value))))
-            # compare width with max_width
-            # set adjusted_width if width of cell is bigger than max_width
-            if len(str(cell.value)) > max_length:
-                max_width = 28
-                adjusted_width = max_width + 2
-            # set column width to adjusted_width's value
-            wb[sheet_name].column_dimensions[column].width = adjusted_width
-    """
-    wb.save(target_file_full_path)
-
-
-# delete empty sheet
-def delete_empty_sheet(target_file_full_path):
-    """
-    :param target_file_full_path: full path of target file
-    """
-    wb = load_workbook(filename=target_file_full_path)
-    for sheet_name in wb.sheetnames:
-        if wb[sheet_name].max_column == 1:
-            del wb[sheet_name]
+    for message in change_details_response_json['messages']:
+        patch_set_number = message.get('_revision_number')
+        message_author = message.get('author', {}).get('name', '')
+        # we regard a tag that conatins 'gerrit:newPatchSet' as the first record of every patch set
+        if 'gerrit:newPatchSet' in message.get('tag', ''):
+            patch_set_uploaders[patch_set_number] = message_author
         else:
-            print('Sheet ' + sheet_name + ' not empty, skip.')
+            # messages of some patch sets have no tag(e.g. created by old gerrit version)
+            # regard author of first message of this patch set as its uploader
+            untagged_patch_set_uploaders.setdefault(patch_set_number, message_author)
+    # tagged messages take precedence over untagged ones
+    for patch_set_number, message_author in untagged_patch_set_uploaders.items():
+        patch_set_uploaders.setdefault(patch_set_number, message_author)
 
-    wb.save(target_file_full_path)
+    return patch_set_uploaders
 
 
-'''
-:parameter
-1. source gerrit json full path
-2. target file full path
-3. gerrit instance ip address
-4. start date(format: YYYY-mm-dd)
-5. end date(format: YYYY-mm-dd)
-'''
-parse_n_write_data_to_target(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
-write_index_n_set_border(sys.argv[2])
-set_columns_width(sys.argv[2])
-delete_empty_sheet(sys.argv[2])
+# classify inline messages: find specific codes in all inline messages and convert these codes to its details
+# messages are handled together by pandas instead of searching and comparing them one by one
+def classify_inline_messages(inline_messages, inline_message_codes=None):
+    """
+    :param inline_messages: list of inline messages
+    :param inline_message_codes: meaning of codes, DEFAULT_INLINE_MESSAGE_CODES if it's None
+    :return: actually_mean_severity_levels: list of the complete meaning of severity level
+    :return: actually_mean_problem_types: list of the complete meaning of problem type
+    messages without codes or with unknown codes have empty meaning
+    """
+    import pandas as pd
+
+    if inline_message_codes is None:
+        inline_message_codes = DEFAULT_INLINE_MESSAGE_CODES
+    if not inline_messages:
+        return [], []
+    inline_message_code_df = pd.Series(inline_messages, dtype='object').str.extract(INLINE_MESSAGE_CODE_PATTERN)
+    actually_mean_severity_levels = inline_message_code_df['severity_level'].map(
+        inline_message_codes['severity_level']).fillna('')
+    actually_mean_problem_types = inline_message_code_df['problem_type'].map(
+        inline_message_codes['problem_type']).fillna('')
+
+    return actually_mean_severity_levels.tolist(), actually_mean_problem_types.tolist()
+
+
+# load meaning of codes in inline message from json file
+def load_inline_message_codes(codes_file_full_path):
+    """
+    :param codes_file_full_path: full path of json file like {"problem_type": {"RE": "..."}, "severity_level": {"F": "..."}}
+                                 None to use DEFAULT_INLINE_MESSAGE_CODES
+    :return: inline_message_codes: meaning of codes
+    """
+    if codes_file_full_path is None:
+        return DEFAULT_INLINE_MESSAGE_CODES
+    with open(codes_file_full_path, encoding='utf-8') as f:
+        inline_message_codes = json.load(f)
+    # codes not given in file are empty
+    return {'problem_type': inline_message_codes.get('problem_type', {}),
+            'severity_level': inline_message_codes.get('severity_level', {})}
+
+
+# parse command line arguments
+def parse_arguments():
+    """
+    :return: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Export review info of gerrit changes to excel.')
+    parser.add_argument('json_file_full_path', help='source gerrit json full path')
+    parser.add_argument('target_file_full_path', help='target file full path')
+    parser.add_argument('gerrit_instance_ip_addr',
+                        help='gerrit instance ip address, use \'-\' with --offline to never request gerrit')
+    parser.add_argument('start_date', help='start date(format: YYYY-mm-dd)')
+    parser.add_argument('end_date', help='end date(format: YYYY-mm-dd)')
+    parser.add_argument('--workers', type=int, default=1, help='number of changes requested from gerrit concurrently')
+    parser.add_argument('--mmap', action='store_true', help='read source gerrit json through memory map')
+    parser.add_argument('--state-file', help='state file of incremental export, only changes updated since last export '
+                        'are exported and appended to target file')
+    parser.add_argument('--offline', action='store_true',
+                        help='build review info from source gerrit json, gerrit is only requested when review time is missing')
+    parser.add_argument('--format', choices=SINK_TYPES, default='excel',
+                        help='type of target file, rows are appended if target file already exists')
+    parser.add_argument('--timezone', default=DEFAULT_TIMEZONE,
+                        help='IANA timezone of start date, end date and review time in target file, like Europe/Berlin')
+    parser.add_argument('--store', help='sqlite store which reviews of all dates are loaded to, target file is created '
+                        'again with reviews of store between start date and end date, use it with --state-file to '
+                        'load new reviews only')
+    parser.add_argument('--inline-message-codes',
+                        help='json file of meaning of problem type and severity level codes in inline message')
+
+    return parser.parse_args()
+
+
+# entry point of command line
+def main():
+    """
+    export review info of changes in gerrit json file to target file, or load it to store and report from store
+    """
+    arguments = parse_arguments()
+    # '-' means no gerrit instance can be requested
+    if arguments.gerrit_instance_ip_addr == '-':
+        arguments.gerrit_instance_ip_addr = None
+    inline_message_codes = load_inline_message_codes(arguments.inline_message_codes)
+    if arguments.store is None:
+        parse_n_write_data_to_target(arguments.json_file_full_path, arguments.target_file_full_path,
+                                     arguments.gerrit_instance_ip_addr, arguments.start_date, arguments.end_date,
+                                     arguments.mmap, arguments.workers, arguments.offline, arguments.state_file,
+                                     arguments.format, inline_message_codes, arguments.timezone)
+        return
+    # load reviews of all dates to store, then report is a query of store between start date and end date
+    # reviews already in store are ignored, so store can be loaded again without state file
+    parse_n_write_data_to_target(arguments.json_file_full_path, arguments.store, arguments.gerrit_instance_ip_addr,
+                                 None, None, arguments.mmap, arguments.workers, arguments.offline, arguments.state_file,
+                                 'sqlite', inline_message_codes, arguments.timezone)
+    write_report_from_store(arguments.store, arguments.target_file_full_path, arguments.start_date, arguments.end_date,
+                            arguments.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+'''
+Sinks of review info rows exported by gerrit_review_info_exporter
+
+Author: s1mple-child
+
+Every sink writes rows one by one and finishes target file in close(), rows are never collected in memory:
+excel: 'Review Info' sheet of xlsx file with index and borders, the slowest one, it's used when report is read by people
+csv: plain text file, new rows are appended to existed file
+parquet: columnar file compressed with zstd, rows are written in row groups, pyarrow is needed
+sqlite: table 'review_info' of sqlite database, new rows are appended to existed table
+        it has indexes on reviewer, project, branch and review date, reports are queried from it by review_info_store
+
+Dependencies of sinks are imported when sink is created, so only the selected one needs to be installed.
+'''
+import csv
+import os
+import sqlite3
+from datetime import datetime
+
+# columns of review info in target file
+REVIEW_INFO_COLUMNS = ['review message', 'review date', 'reviewed file', 'line number of reviewed file',
+                       'inline message problem type', 'inline message severity level', 'change status',
+                       'patch set uploader', 'reviewer', 'project name', 'branch name', 'change number/patch set number']
+# index of 'review date' and 'line number of reviewed file' in REVIEW_INFO_COLUMNS
+REVIEW_DATE_INDEX = 1
+LINE_NUMBER_INDEX = 3
+# format of review date in text files and databases
+REVIEW_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# name of sqlite table and its columns, in the same order as REVIEW_INFO_COLUMNS
+SQLITE_TABLE_NAME = 'review_info'
+SQLITE_COLUMNS = ['review_message', 'review_date', 'reviewed_file', 'line_number', 'problem_type', 'severity_level',
+                  'change_status', 'patch_set_uploader', 'reviewer', 'project_name', 'branch_name', 'change_patch_set']
+# columns identify one review in sqlite table, review loaded again is ignored
+# line number is NULL for file level comment and NULL values are always different in unique index, so 0 is used instead
+SQLITE_UNIQUE_COLUMNS = ['change_patch_set', 'reviewed_file', 'IFNULL(line_number, 0)', 'reviewer', 'review_date',
+                         'review_message']
+# columns of sqlite table with index, reports are usually filtered by them
+SQLITE_INDEXED_COLUMNS = ['reviewer', 'project_name', 'branch_name', 'review_date']
+# rows inserted into sqlite with one statement
+SQLITE_BATCH_SIZE = 10000
+# rows in one row group of parquet file
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# names of styles in 'Review Info' sheet of excel file
+REVIEW_INFO_HEADER_STYLE = 'Review Info Header'
+REVIEW_INFO_CELL_STYLE = 'Review Info Cell'
+REVIEW_INFO_DATE_STYLE = 'Review Info Date'
+# width of columns in 'Review Info' sheet, column A is index, other columns are not listed here have width 23
+REVIEW_INFO_COLUMN_WIDTHS = {'A': 5, 'B': 55, 'C': 23, 'D': 55, 'E': 10, 'F': 15, 'G': 10, 'H': 15, 'I': 15, 'J': 15,
+                             'K': 23, 'L': 23, 'M': 23}
+
+# sink types which can be selected in command line
+SINK_TYPES = ['excel', 'csv', 'parquet', 'sqlite']
+
+
+# create sink of given type
+def create_review_info_sink(sink_type, target_file_full_path):
+    """
+    :param sink_type: one of SINK_TYPES
+    :param target_file_full_path: full path of target file
+    :return: sink which has append_row(row) and close()
+    """
+    if sink_type == 'excel':
+        return ReviewInfoExcelWriter(target_file_full_path)
+    if sink_type == 'csv':
+        return ReviewInfoCsvSink(target_file_full_path)
+    if sink_type == 'parquet':
+        return ReviewInfoParquetSink(target_file_full_path)
+    if sink_type == 'sqlite':
+        return ReviewInfoSqliteSink(target_file_full_path)
+
+    raise ValueError('Unknown sink type ' + sink_type + ', it should be one of ' + ', '.join(SINK_TYPES))
+
+
+# convert review row to values stored in text files and databases
+def convert_row_to_plain_values(row):
+    """
+    :param row: values of one review, the order is the same as REVIEW_INFO_COLUMNS
+    :return: plain_row: review date is formatted as text and empty line number is None
+    """
+    plain_row = list(row)
+    if isinstance(plain_row[REVIEW_DATE_INDEX], datetime):
+        plain_row[REVIEW_DATE_INDEX] = plain_row[REVIEW_DATE_INDEX].strftime(REVIEW_DATE_FORMAT)
+    if plain_row[LINE_NUMBER_INDEX] == '':
+        plain_row[LINE_NUMBER_INDEX] = None
+
+    return plain_row
+
+
+# collect review rows and write target workbook only once when export finished
+# rows are streamed to a write-only worksheet, so memory doesn't grow with number of rows
+# index, borders and column widths are set while rows are written, target file is never loaded again after save
+class ReviewInfoExcelWriter:
+    """
+    write rows of 'Review Info' sheet to target excel file with a single save
+    """
+    def __init__(self, target_file_full_path):
+        """
+        :param target_file_full_path: full path of target file
+        """
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+        self.write_only_cell = WriteOnlyCell
+        self.target_file_full_path = target_file_full_path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        # named styles are saved once in workbook and shared by all cells, instead of style of every cell
+        for named_style in create_review_info_styles():
+            self.workbook.add_named_style(named_style)
+        self.review_info_sheet = None
+        self.review_info_index = 0
+        # copy sheets already existed in target file, rows of 'Review Info' are kept before new rows
+        if os.path.exists(target_file_full_path):
+            source_wb = openpyxl.load_workbook(target_file_full_path, read_only=True)
+            for sheet_name in source_wb.sheetnames:
+                source_sheet = source_wb[sheet_name]
+                source_rows = source_sheet.iter_rows(values_only=True)
+                if sheet_name == 'Review Info':
+                    self.create_review_info_sheet()
+                    # index column is written again, drop it so new rows stay aligned
+                    header_row = next(source_rows, None)
+                    if header_row is not None and header_row[0] == 'Index':
+                        source_rows = (row[1:] for row in source_rows)
+                    for row in source_rows:
+                        self.append_row(row)
+                elif source_sheet.max_column == 1:
+                    print('Sheet ' + sheet_name + ' is empty, delete it.')
+                else:
+                    target_sheet = self.workbook.create_sheet(sheet_name)
+                    for row in source_rows:
+                        target_sheet.append(row)
+            source_wb.close()
+        if self.review_info_sheet is None:
+            self.create_review_info_sheet()
+
+    def create_review_info_sheet(self):
+        """
+        create 'Review Info' sheet with column widths and header row
+        """
+        self.review_info_sheet = self.workbook.create_sheet('Review Info')
+        # widths must be set before the first row is written to write-only sheet
+        for column_letter, column_width in REVIEW_INFO_COLUMN_WIDTHS.items():
+            self.review_info_sheet.column_dimensions[column_letter].width = column_width
+        self.review_info_sheet.append([self.create_styled_cell(title, REVIEW_INFO_HEADER_STYLE)
+                                       for title in ['Index'] + REVIEW_INFO_COLUMNS])
+
+    def create_styled_cell(self, value, style_name):
+        """
+        :param value: value of cell
+        :param style_name: name of named style registered in workbook
+        :return: cell: write-only cell with named style
+        """
+        cell = self.write_only_cell(self.review_info_sheet, value=value)
+        cell.style = style_name
+        return cell
+
+    def append_row(self, row):
+        """
+        :param row: values of one review, the order is the same as REVIEW_INFO_COLUMNS
+        """
+        self.review_info_index += 1
+        styled_row = [self.create_styled_cell(self.review_info_index, REVIEW_INFO_CELL_STYLE)]
+        for i, value in enumerate(row):
+            styled_row.append(self.create_styled_cell(value, REVIEW_INFO_DATE_STYLE if i == REVIEW_DATE_INDEX
+                                                      else REVIEW_INFO_CELL_STYLE))
+        self.review_info_sheet.append(styled_row)
+
+    def close(self):
+        """
+        save all sheets to target file
+        """
+        self.workbook.save(self.target_file_full_path)
+
+
+# create named styles of 'Review Info' sheet, all cells have left alignment and thin black border
+def create_review_info_styles():
+    """
+    :return: named_styles: styles of header, cell and review date cell
+    """
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+
+    thin_side = Side(style='thin', color='000000')
+    border = Border(left=thin_side, right=thin_side, top=thin_side, bottom=thin_side)
+    header_style = NamedStyle(name=REVIEW_INFO_HEADER_STYLE, font=Font(bold=True), border=border,
+                              alignment=Alignment(horizontal='center', vertical='top'))
+    cell_style = NamedStyle(name=REVIEW_INFO_CELL_STYLE, border=border, alignment=Alignment(horizontal='left'))
+    date_style = NamedStyle(name=REVIEW_INFO_DATE_STYLE, border=border, alignment=Alignment(horizontal='left'),
+                            number_format='yyyy-mm-dd hh:mm:ss')
+
+    return [header_style, cell_style, date_style]
+
+
+# stream review rows to csv file
+class ReviewInfoCsvSink:
+    """
+    write rows to csv file, header is written only when file is created
+    """
+    def __init__(self, target_file_full_path):
+        """
+        :param target_file_full_path: full path of target file
+        """
+        file_existed = os.path.exists(target_file_full_path) and os.path.getsize(target_file_full_path) > 0
+        self.target_file = open(target_file_full_path, 'a', encoding='utf-8', newline='')
+        self.csv_writer = csv.writer(self.target_file)
+        if not file_existed:
+            self.csv_writer.writerow(REVIEW_INFO_COLUMNS)
+
+    def append_row(self, row):
+        """
+        :param row: values of one review, the order is the same as REVIEW_INFO_COLUMNS
+        """
+        self.csv_writer.writerow(convert_row_to_plain_values(row))
+
+    def close(self):
+        """
+        flush and close csv file
+        """
+        self.target_file.close()
+
+
+# write review rows to parquet file in row groups
+class ReviewInfoParquetSink:
+    """
+    buffer at most one row group in memory, rows of existed target file are copied to new file before new rows
+    """
+    def __init__(self, target_file_full_path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        """
+        :param target_file_full_path: full path of target file
+        :param row_group_size: number of rows in one row group
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.target_file_full_path = target_file_full_path
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(column, pa.timestamp('s') if i == REVIEW_DATE_INDEX else
+                                  pa.int64() if i == LINE_NUMBER_INDEX else pa.string())
+                                 for i, column in enumerate(REVIEW_INFO_COLUMNS)])
+        # parquet file can't be appended, new file is written then renamed to target file in close()
+        self.temp_file_full_path = target_file_full_path + '.tmp'
+        self.parquet_writer = pq.ParquetWriter(self.temp_file_full_path, self.schema, compression='zstd')
+        self.buffered_columns = [[] for _ in REVIEW_INFO_COLUMNS]
+        if os.path.exists(target_file_full_path):
+            source_file = pq.ParquetFile(target_file_full_path)
+            for i in range(source_file.num_row_groups):
+                self.parquet_writer.write_table(source_file.read_row_group(i).cast(self.schema))
+
+    def append_row(self, row):
+        """
+        :param row: values of one review, the order is the same as REVIEW_INFO_COLUMNS
+        """
+        for i, value in enumerate(row):
+            if i == LINE_NUMBER_INDEX and value == '':
+                value = None
+            self.buffered_columns[i].append(value)
+        if len(self.buffered_columns[0]) >= self.row_group_size:
+            self.write_row_group()
+
+    def write_row_group(self):
+        """
+        write buffered rows as one row group
+        """
+        if not self.buffered_columns[0]:
+            return
+        column_arrays = [self.pa.array(column_values, type=field.type)
+                         for column_values, field in zip(self.buffered_columns, self.schema)]
+        self.parquet_writer.write_table(self.pa.Table.from_arrays(column_arrays, schema=self.schema))
+        self.buffered_columns = [[] for _ in REVIEW_INFO_COLUMNS]
+
+    def close(self):
+        """
+        write the last row group and replace target file
+        """
+        self.write_row_group()
+        self.parquet_writer.close()
+        os.replace(self.temp_file_full_path, self.target_file_full_path)
+
+
+# insert review rows into sqlite table in batches
+class ReviewInfoSqliteSink:
+    """
+    write rows to table 'review_info', table and its indexes are created if they don't exist
+    rows already in table are ignored, so the same json file can be loaded again
+    """
+    def __init__(self, target_file_full_path, batch_size=SQLITE_BATCH_SIZE):
+        """
+        :param target_file_full_path: full path of sqlite database
+        :param batch_size: number of rows inserted with one statement
+        """
+        self.connection = sqlite3.connect(target_file_full_path)
+        self.batch_size = batch_size
+        self.buffered_rows = []
+        self.connection.execute('CREATE TABLE IF NOT EXISTS ' + SQLITE_TABLE_NAME + ' ('
+                                + ', '.join(column + (' INTEGER' if column == 'line_number' else ' TEXT')
+                                            for column in SQLITE_COLUMNS) + ')')
+        self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_' + SQLITE_TABLE_NAME + '_review ON '
+                                + SQLITE_TABLE_NAME + ' (' + ', '.join(SQLITE_UNIQUE_COLUMNS) + ')')
+        self.insert_statement = ('INSERT OR IGNORE INTO ' + SQLITE_TABLE_NAME + ' (' + ', '.join(SQLITE_COLUMNS) + ') VALUES ('
+                                 + ', '.join('?' for _ in SQLITE_COLUMNS) + ')')
+
+    def append_row(self, row):
+        """
+        :param row: values of one review, the order is the same as REVIEW_INFO_COLUMNS
+        """
+        self.buffered_rows.append(convert_row_to_plain_values(row))
+        if len(self.buffered_rows) >= self.batch_size:
+            self.insert_buffered_rows()
+
+    def insert_buffered_rows(self):
+        """
+        insert buffered rows into table
+        """
+        self.connection.executemany(self.insert_statement, self.buffered_rows)
+        self.buffered_rows = []
+
+    def close(self):
+        """
+        insert the last rows, commit all of them in one transaction and close database
+        """
+        self.insert_buffered_rows()
+        # indexes are created after the first load, so rows of first export aren't inserted into indexes one by one
+        for column in SQLITE_INDEXED_COLUMNS:
+            self.connection.execute('CREATE INDEX IF NOT EXISTS idx_' + SQLITE_TABLE_NAME + '_' + column + ' ON '
+                                    + SQLITE_TABLE_NAME + ' (' + column + ')')
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,116 @@
+'''
+Review info store: create reports from sqlite database loaded by gerrit_review_info_exporter
+
+Author: s1mple-child
+
+Step 1: load review info to store, run it again with --state-file to load new reviews only
+'python gerrit_review_info_exporter.py gerrit.json report.xlsx gerrit.ip.addr 2024-01-01 2024-12-31 --store review_info.db'
+
+Step 2: create report of any date range, reviewer, project or branch from store without gerrit json and gerrit
+'python review_info_store.py review_info.db report.xlsx 2024-03-01 2024-04-01 --reviewer user1 --project project1'
+
+Store is a sqlite database with table 'review_info' created by ReviewInfoSqliteSink,
+review date is saved as local time text, so range of dates is queried with index of review date.
+'''
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+from review_info_sinks import (LINE_NUMBER_INDEX, REVIEW_DATE_FORMAT, REVIEW_DATE_INDEX, SINK_TYPES,
+                               SQLITE_COLUMNS, SQLITE_TABLE_NAME, create_review_info_sink)
+
+
+# query review info rows from store
+def query_review_info(store_full_path, start_date, end_date, reviewers=None, project_names=None, branch_names=None):
+    """
+    :param store_full_path: full path of sqlite store
+    :param start_date: start date, format is YYYY-mm-dd
+    :param end_date: end date, format is YYYY-mm-dd, both dates are midnight as same as export
+    :param reviewers: list of reviewer usernames, None for all reviewers
+    :param project_names: list of project names, None for all projects
+    :param branch_names: list of branch names, None for all branches
+    :return: generator of rows, the order of values is the same as REVIEW_INFO_COLUMNS
+    """
+    # review date is text like '2024-03-01 10:00:00', it's compared as text with index
+    conditions = ['review_date >= ?', 'review_date <= ?']
+    parameters = [datetime.strptime(start_date, '%Y-%m-%d').strftime(REVIEW_DATE_FORMAT),
+                  datetime.strptime(end_date, '%Y-%m-%d').strftime(REVIEW_DATE_FORMAT)]
+    for column, values in (('reviewer', reviewers), ('project_name', project_names), ('branch_name', branch_names)):
+        if values:
+            conditions.append(column + ' IN (' + ', '.join('?' for _ in values) + ')')
+            parameters.extend(values)
+    query = ('SELECT ' + ', '.join(SQLITE_COLUMNS) + ' FROM ' + SQLITE_TABLE_NAME + ' WHERE ' + ' AND '.join(conditions)
+             + ' ORDER BY review_date, rowid')
+
+    # open store read only, so report never changes it
+    connection = sqlite3.connect('file:' + store_full_path + '?mode=ro', uri=True)
+    try:
+        for row in connection.execute(query, parameters):
+            row = list(row)
+            # convert values back to the same values as export
+            row[REVIEW_DATE_INDEX] = datetime.strptime(row[REVIEW_DATE_INDEX], REVIEW_DATE_FORMAT)
+            if row[LINE_NUMBER_INDEX] is None:
+                row[LINE_NUMBER_INDEX] = ''
+            yield row
+    finally:
+        connection.close()
+
+
+# write report of rows queried from store to target file
+def write_report_from_store(store_full_path, target_file_full_path, start_date, end_date, sink_type='excel',
+                            reviewers=None, project_names=None, branch_names=None):
+    """
+    target file is created again, rows of former report are not kept
+    :param store_full_path: full path of sqlite store
+    :param target_file_full_path: full path of target file
+    :param start_date: start date, format is YYYY-mm-dd
+    :param end_date: end date, format is YYYY-mm-dd
+    :param sink_type: type of target file, one of SINK_TYPES
+    :param reviewers: list of reviewer usernames, None for all reviewers
+    :param project_names: list of project names, None for all projects
+    :param branch_names: list of branch names, None for all branches
+    """
+    if not os.path.exists(store_full_path):
+        raise FileNotFoundError('Store ' + store_full_path + ' not found, load it with gerrit_review_info_exporter first.')
+    if os.path.exists(target_file_full_path):
+        os.remove(target_file_full_path)
+    review_info_sink = create_review_info_sink(sink_type, target_file_full_path)
+    written_rows_count = 0
+    for row in query_review_info(store_full_path, start_date, end_date, reviewers, project_names, branch_names):
+        review_info_sink.append_row(row)
+        written_rows_count += 1
+    review_info_sink.close()
+    print('Writing ' + str(written_rows_count) + ' review rows from store to ' + target_file_full_path + '.')
+
+
+# parse command line arguments
+def parse_arguments():
+    """
+    :return: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Create review info report from store of gerrit review info.')
+    parser.add_argument('store_full_path', help='sqlite store loaded by gerrit_review_info_exporter with --store')
+    parser.add_argument('target_file_full_path', help='target file full path, it is created again')
+    parser.add_argument('start_date', help='start date(format: YYYY-mm-dd)')
+    parser.add_argument('end_date', help='end date(format: YYYY-mm-dd)')
+    parser.add_argument('--format', choices=SINK_TYPES, default='excel', help='type of target file')
+    parser.add_argument('--reviewer', action='append', help='username of reviewer, can be given several times')
+    parser.add_argument('--project', action='append', help='project name, can be given several times')
+    parser.add_argument('--branch', action='append', help='branch name, can be given several times')
+
+    return parser.parse_args()
+
+
+# entry point of command line
+def main():
+    """
+    write report of rows queried from store to target file
+    """
+    arguments = parse_arguments()
+    write_report_from_store(arguments.store_full_path, arguments.target_file_full_path, arguments.start_date,
+                            arguments.end_date, arguments.format, arguments.reviewer, arguments.project,
+                            arguments.branch)
+
+
+if __name__ == '__main__':
+    main()
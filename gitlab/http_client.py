@@ -0,0 +1,131 @@
+'''
+Shared HTTP client for gerrit and gitlab scripts
+
+Author: s1mple-child
+
+Every host gets one pooled session, so requests to the same host reuse keep-alive connections
+instead of doing a new TCP handshake and auth every time.
+Requests failed with 429 or 5xx are retried with exponential backoff.
+Response body is decoded only once by decode_json_response, orjson is used when it's installed.
+
+Scripts under gerrit directory import this module too, run them with this directory in PYTHONPATH.
+requests is imported when the first session is created, so importing this module is cheap.
+'''
+import json
+import threading
+
+# orjson is optional, it decodes large responses several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# number of keep-alive connections kept for every host, should not be less than number of worker threads
+POOL_SIZE = 16
+# retry times of request which failed with one of RETRY_STATUS_CODES or connection error
+RETRY_TOTAL = 5
+# sleep {backoff factor} * (2 ** (retry times - 1)) seconds between retries
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# gerrit adds this prefix at the beginning of every json response to prevent XSSI
+GERRIT_XSSI_PREFIX = b")]}'"
+
+# sessions created by get_session, key is (host, auth)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# change pool size and retry settings of sessions
+def configure_http_client(pool_size=None, retry_total=None, retry_backoff_factor=None):
+    """
+    change settings of sessions, sessions created before are closed and created again when requested
+    :param pool_size: number of keep-alive connections kept for every host
+    :param retry_total: retry times of failed request
+    :param retry_backoff_factor: backoff factor between retries
+    """
+    global POOL_SIZE, RETRY_TOTAL, RETRY_BACKOFF_FACTOR
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if retry_total is not None:
+        RETRY_TOTAL = retry_total
+    if retry_backoff_factor is not None:
+        RETRY_BACKOFF_FACTOR = retry_backoff_factor
+    close_all_sessions()
+
+
+# get pooled session of host
+def get_session(host, auth=None):
+    """
+    return session of given host, the same session is returned for the same host and auth
+    :param host: host of request, like ip address of gerrit or gitlab
+    :param auth: (username, password) of http basic auth, None if auth is not needed
+    :return: session: requests session with pooled connections and retry
+    """
+    session_key = (host, auth)
+    with _sessions_lock:
+        session = _sessions.get(session_key)
+        if session is None:
+            session = create_pooled_session(auth)
+            _sessions[session_key] = session
+
+    return session
+
+
+# create session with pooled connection adapter and retry
+def create_pooled_session(auth=None):
+    """
+    :param auth: (username, password) of http basic auth, None if auth is not needed
+    :return: session: requests session with pooled connections and retry
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # only idempotent methods are retried on 5xx, response of last retry is returned instead of raising error
+    retry = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUS_CODES,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if auth is not None:
+        session.auth = auth
+
+    return session
+
+
+# close all sessions, it's called when settings changed or script finished
+def close_all_sessions():
+    """
+    close connections of all sessions created by get_session
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+# decode json body of response of gerrit or gitlab
+def decode_json_response(response):
+    """
+    :param response: response of requests
+    :return: decoded json of response body
+    """
+    # use raw bytes instead of response.text, which guesses encoding and copies body again
+    response_body = response.content
+    if response_body.startswith(GERRIT_XSSI_PREFIX):
+        response_body = response_body[len(GERRIT_XSSI_PREFIX):]
+
+    return loads_json(response_body)
+
+
+# decode json string or bytes with the fastest json library installed
+def loads_json(json_data):
+    """
+    :param json_data: json string or bytes
+    :return: decoded json
+    """
+    if orjson is not None:
+        return orjson.loads(json_data)
+
+    return json.loads(json_data)
@@ -6,49 +6,72 @@ you can use mirror feature in gitlab.
 
 Author: s1mple-child
 
+Step 1: create group and all projects of source group in target gitlab
+Step 2: optional, transfer repositories with 'git clone --mirror' and 'git push', several repositories at the same time
+        mirrors are kept in a local cache directory, so next transfer only fetches new refs
 '''
-import json
-import sys
-import requests
-from migrate_from_gitlab_2gerrit import set_access_token_gitlab, find_group_in_gitlab
+import argparse
+import base64
+import os
+import subprocess
+from http_client import get_session, decode_json_response
+from migration_journal import MigrationJournal
+from migrate_from_gitlab_2gerrit import set_access_token_gitlab, find_group_in_gitlab, iter_gitlab_list
+from worker_pool import map_in_order
 
 
 # find projects under given group name in gitlab
-def find_all_projects_in_gitlab(source_gitlab_ip, target_gitlab_ip, group_name):
+def find_all_projects_in_gitlab(source_gitlab_ip, target_gitlab_ip, group_name, journal=None):
     """
     find all projects under given group in gitlab then create all of them in target gitlab
     :param source_gitlab_ip: source gitlab ip address
     :param target_gitlab_ip: target gitlab ip address
     :param group_name: group name need to find in gitlab
+    :param journal: MigrationJournal of this migration, projects created by a crashed migration are skipped
+    :return: repository_transfers: list of (project path, source repository url, target repository url)
     """
-    # set access token for http request
-    gitlab_access_token = set_access_token_gitlab(source_gitlab_ip)
+    if journal is None:
+        journal = MigrationJournal()
     if '/' in group_name:
         group_name = group_name.replace('/', '%2F')
 
     target_group_id = find_group_in_gitlab(source_gitlab_ip, group_name)
-    page = 1
+    # create new group in target gitlab, all projects are created under it
+    group_step_key = 'create_group:' + group_name
+    new_group_id = journal.get_result(group_step_key)
+    if new_group_id is None:
+        new_group_id = create_group_in_target_gitlab(target_gitlab_ip, group_name)
+        journal.record(group_step_key, new_group_id)
     count = 0
-    while True:
-        # find all projects under target group
-        all_projects_finding_response = requests.get('http://' + source_gitlab_ip + '/api/v4/groups/' 
-        + str(target_group_id) + '/projects?private_token=' + gitlab_access_token + '&page=' + str(page)).text
-
-        # project not found in gitlab
-        if not json.loads(all_projects_finding_response):
-            break
-        for i in range(len(json.loads(all_projects_finding_response))):
-            project_id = json.loads(all_projects_finding_response)[i]['id']
-            project_name = json.loads(all_projects_finding_response)[i]['name']
+    repository_transfers = []
+    # find all projects under target group, pages are requested with 100 projects per page
+    for project in iter_gitlab_list(source_gitlab_ip, 'groups/' + str(target_group_id) + '/projects'):
+        project_id = project['id']
+        project_name = project['name']
+        project_step_key = 'create_project:' + group_name + '/' + project_name
+        new_project = journal.get_result(project_step_key)
+        # only project with its id and repository url in journal is completed
+        if isinstance(new_project, dict):
+            print('Project ' + project_name + ' already created in target gitlab, skip.')
+        else:
             print('Project ' + project_name + ' is under ' + group_name + ' of gitlab and its id is ' + str(project_id))
-            # create new group in target gitlab
-            new_group_id = create_group_in_target_gitlab(target_gitlab_ip, group_name)
             # create project in target gitlab with given project name
-            create_project_in_target_gitlab(target_gitlab_ip, new_group_id, project_name)
+            new_project = create_project_in_target_gitlab(target_gitlab_ip, new_group_id, project_name)
+            if new_project is None:
+                # project can't be created and not existed, it's created again when migration is started again
+                print('Project ' + project_name + ' can\'t be created in target gitlab.')
+                continue
+            journal.record(project_step_key, new_project)
             count += 1
-        page += 1
+        if new_project.get('http_url_to_repo'):
+            repository_transfers.append((project['path_with_namespace'], project['http_url_to_repo'],
+                                         new_project['http_url_to_repo']))
+        else:
+            print('Repository url of ' + project_name + ' in target gitlab not found, its repository is not transferred.')
     print('Total number of created projects is: ' + str(count))
 
+    return repository_transfers
+
 
 # check and create group in target gitlab
 def create_group_in_target_gitlab(target_gitlab_ip, group_name):
@@ -63,21 +86,22 @@ def create_group_in_target_gitlab(target_gitlab_ip, group_name):
     # add a new user as 'developer' role in target gitlab
     # this use is already existed in target gitlab
     access_level = '30'
-    group_finding_response = requests.get('http://' + target_gitlab_ip + '/api/v4/groups?private_token=' 
-    + gitlab_access_token + '&search=' + group_name).text
-    if len(json.loads(group_finding_response)) == 0:
+    group_finding_response = decode_json_response(get_session(target_gitlab_ip).get('http://' + target_gitlab_ip
+    + '/api/v4/groups?private_token=' + gitlab_access_token + '&search=' + group_name))
+    if len(group_finding_response) == 0:
         # group not found in target gitlab, create new one
-        create_group_response = requests.post('http://' + target_gitlab_ip + '/api/v4/groups?private_token=' 
-        + gitlab_access_token + '&name=' + group_name + '&path=' + group_name + '&visibility=internal').text
-        # find its id from response text
-        new_group_id = json.loads(create_group_response)["id"]
+        create_group_response = decode_json_response(get_session(target_gitlab_ip).post('http://' + target_gitlab_ip
+        + '/api/v4/groups?private_token=' + gitlab_access_token + '&name=' + group_name + '&path=' + group_name
+        + '&visibility=internal'))
+        # find its id from response json
+        new_group_id = create_group_response["id"]
         # add a user to new group
         user_id = find_user_id_in_gitlab(target_gitlab_ip, 'foo')
         # add user 'foo' to new group and set developer role
-        requests.post('http://' + target_gitlab_ip + '/api/v4/groups/' + str(new_group_id) + '/members?private_token=' 
+        get_session(target_gitlab_ip).post('http://' + target_gitlab_ip + '/api/v4/groups/' + str(new_group_id) + '/members?private_token=' 
         + gitlab_access_token + '&user_id=' + str(user_id) + '&access_level=' + access_level)
     else:
-        new_group_id = json.loads(group_finding_response)[0]["id"]
+        new_group_id = group_finding_response[0]["id"]
     
     return new_group_id
 
@@ -89,10 +113,37 @@ def create_project_in_target_gitlab(gitlab_ip, group_id, project_name):
     :param gitlab_ip: gitlab ip address
     :param group_id: group id in gitlab
     :param project_name: project name in gitlab
+    :return: new_project: {'id': id of project, 'http_url_to_repo': repository url}
+             existed project is returned if project already existed, None if project can't be created
     """
     gitlab_access_token = set_access_token_gitlab(gitlab_ip)
-    requests.post('http://' + gitlab_ip + '/api/v4/projects?access_token=' + gitlab_access_token 
-    + '&name=' + project_name + '&namespace_id=' + str(group_id)+ '&visibility=internal')
+    create_project_response = decode_json_response(get_session(gitlab_ip).post('http://' + gitlab_ip
+    + '/api/v4/projects?access_token=' + gitlab_access_token + '&name=' + project_name + '&namespace_id='
+    + str(group_id)+ '&visibility=internal'))
+
+    if 'id' not in create_project_response:
+        # project already existed or can't be created
+        print('Create project ' + project_name + ' failed: ' + str(create_project_response.get('message')))
+        return find_project_in_target_gitlab(gitlab_ip, group_id, project_name)
+
+    return {'id': create_project_response['id'], 'http_url_to_repo': create_project_response['http_url_to_repo']}
+
+
+# find project under target group in target gitlab
+def find_project_in_target_gitlab(gitlab_ip, group_id, project_name):
+    """
+    :param gitlab_ip: gitlab ip address
+    :param group_id: group id in gitlab
+    :param project_name: project name in gitlab
+    :return: project: {'id': id of project, 'http_url_to_repo': repository url}, None if not found
+    """
+    for project in iter_gitlab_list(gitlab_ip, 'groups/' + str(group_id) + '/projects', {'search': project_name}):
+        # search also returns projects whose name contains project name
+        if project['name'] == project_name:
+            print('Project ' + project_name + ' already existed in target gitlab, its id is ' + str(project['id']))
+            return {'id': project['id'], 'http_url_to_repo': project['http_url_to_repo']}
+
+    return None
 
 
 # find user id in gitlab with given user
@@ -105,12 +156,126 @@ def find_user_id_in_gitlab(target_gitlab_ip, user_name):
     """
     # set access token for http request
     gitlab_access_token = set_access_token_gitlab(target_gitlab_ip)
-    user_finding_response = requests.get('http://' + target_gitlab_ip + '/api/v4/users?private_token=' 
-    + gitlab_access_token + '&username=' + user_name).text
-    # get user id from response text
-    user_id = json.loads(user_finding_response)[0]["id"]
+    user_finding_response = decode_json_response(get_session(target_gitlab_ip).get('http://' + target_gitlab_ip
+    + '/api/v4/users?private_token=' + gitlab_access_token + '&username=' + user_name))
+    # get user id from response json
+    user_id = user_finding_response[0]["id"]
 
     return user_id
 
 
-find_all_projects_in_gitlab(sys.argv[1], sys.argv[2], sys.argv[3])
+# transfer repositories from source gitlab to target gitlab concurrently
+def transfer_repositories(source_gitlab_ip, target_gitlab_ip, repository_transfers, mirror_cache_dir, max_workers=4):
+    """
+    :param source_gitlab_ip: source gitlab ip address
+    :param target_gitlab_ip: target gitlab ip address
+    :param repository_transfers: list of (project path, source repository url, target repository url)
+    :param mirror_cache_dir: directory of local mirrors, mirrors are reused by next transfer
+    :param max_workers: number of repositories transferred at the same time
+    """
+    source_auth_header = create_git_auth_header(set_access_token_gitlab(source_gitlab_ip))
+    target_auth_header = create_git_auth_header(set_access_token_gitlab(target_gitlab_ip))
+
+    def transfer(repository_transfer):
+        project_path, source_repo_url, target_repo_url = repository_transfer
+        mirror_dir = os.path.join(mirror_cache_dir, project_path + '.git')
+        try:
+            mirror_repository(source_repo_url, target_repo_url, mirror_dir, source_auth_header, target_auth_header)
+        except subprocess.CalledProcessError as error:
+            print('Transfer repository ' + project_path + ' failed: ' + error.stderr.strip())
+            return False
+        except FileNotFoundError:
+            print('Transfer repository ' + project_path + ' failed: git is not found in PATH.')
+            return False
+        print('Repository ' + project_path + ' transferred to target gitlab.')
+        return True
+
+    # every transfer runs git in its own processes, threads here only wait for them
+    transferred_results = list(map_in_order(transfer, repository_transfers, max_workers))
+    print('Total number of transferred repositories is: ' + str(sum(transferred_results)) + '/'
+          + str(len(transferred_results)))
+
+
+# fetch repository into local mirror then push branches and tags to target repository
+def mirror_repository(source_repo_url, target_repo_url, mirror_dir, source_auth_header, target_auth_header):
+    """
+    :param source_repo_url: http url of source repository
+    :param target_repo_url: http url of target repository
+    :param mirror_dir: directory of local bare mirror
+    :param source_auth_header: http auth header for source gitlab
+    :param target_auth_header: http auth header for target gitlab
+    """
+    if os.path.isdir(mirror_dir):
+        # mirror created by previous transfer, only fetch new refs and drop deleted ones
+        run_git(['-C', mirror_dir, 'remote', 'set-url', 'origin', source_repo_url])
+        run_git(['-C', mirror_dir, 'fetch', '--prune', 'origin'], source_auth_header)
+    else:
+        os.makedirs(os.path.dirname(mirror_dir), exist_ok=True)
+        run_git(['clone', '--mirror', source_repo_url, mirror_dir], source_auth_header)
+    # 'push --mirror' also pushes refs/merge-requests/* and other hidden refs that gitlab rejects
+    # so only branches and tags are pushed, deleted ones are pruned in target
+    run_git(['-C', mirror_dir, 'push', '--prune', target_repo_url, '+refs/heads/*:refs/heads/*',
+             '+refs/tags/*:refs/tags/*'], target_auth_header)
+
+
+# create http auth header with gitlab access token
+def create_git_auth_header(gitlab_access_token):
+    """
+    :param gitlab_access_token: access token of gitlab
+    :return: http header like 'Authorization: Basic ...'
+    """
+    basic_auth = base64.b64encode(('oauth2:' + gitlab_access_token).encode('utf-8')).decode('ascii')
+
+    return 'Authorization: Basic ' + basic_auth
+
+
+# run git command and raise CalledProcessError when it failed, FileNotFoundError when git is not installed
+# auth header is passed as git config in environment of git process, so it's neither shown in command line of 'ps'
+# nor saved in config of local mirror
+def run_git(git_args, auth_header=None):
+    """
+    :param git_args: arguments of git command
+    :param auth_header: http auth header created by create_git_auth_header, None for commands without network
+    """
+    git_env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    if auth_header is not None:
+        git_env.update(GIT_CONFIG_COUNT='1', GIT_CONFIG_KEY_0='http.extraHeader', GIT_CONFIG_VALUE_0=auth_header)
+    subprocess.run(['git'] + git_args, check=True, capture_output=True, text=True, env=git_env)
+
+
+# parse command line arguments
+def parse_arguments():
+    """
+    :return: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Migrate group and projects between two GitLab instances.')
+    parser.add_argument('source_gitlab_ip', help='source gitlab ip address')
+    parser.add_argument('target_gitlab_ip', help='target gitlab ip address')
+    parser.add_argument('group_name', help='group name of source gitlab')
+    parser.add_argument('--journal', help='journal file full path, projects recorded in it are skipped '
+                        'when migration is started again')
+    parser.add_argument('--mirror-cache', help='directory of local mirrors, repositories are transferred only '
+                        'when it is given')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of repositories transferred at the same time, default is 4')
+
+    return parser.parse_args()
+
+
+# entry point of command line
+def main():
+    """
+    create projects of source group in target gitlab, then transfer repositories when --mirror-cache is given
+    """
+    arguments = parse_arguments()
+    migration_journal = MigrationJournal(arguments.journal)
+    all_repository_transfers = find_all_projects_in_gitlab(arguments.source_gitlab_ip, arguments.target_gitlab_ip,
+                                                           arguments.group_name, migration_journal)
+    migration_journal.close()
+    if arguments.mirror_cache is not None:
+        transfer_repositories(arguments.source_gitlab_ip, arguments.target_gitlab_ip, all_repository_transfers,
+                              arguments.mirror_cache, arguments.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,37 @@ Migrate repositories only from GitLab to Gerrit
 Author: s1mple-child
 
 Step 1: find all projects under given group
-Step 2: create all projects in gerrit
+Step 2: read existing projects and groups in gerrit and plan what need to create
+Step 3: create projects in gerrit while gitlab is paged, or only print the whole plan with --dry-run
 '''
+import argparse
 import json
-import sys
-import requests
-import massedit
+import os
+import threading
+from functools import lru_cache
+from urllib.parse import unquote
+import http_client
+from http_client import get_session, decode_json_response
+from migration_journal import MigrationJournal
+from worker_pool import map_in_order
+
+# resolved account ids and groups of gerrit, shared by all functions in this file
+# key is gerrit ip address, value is dict maps username to account id or group name to group info
+_resolved_account_ids = {}
+_resolved_groups = {}
+_resolved_entities_lock = threading.Lock()
+# projects prefetched by prefetch_gerrit_entities, key is gerrit ip address, value is set of project names
+_existing_projects = {}
+# project name prefix used by prefetch_gerrit_entities, only projects under it are in _existing_projects
+_prefetched_project_prefixes = {}
+# gerrit ip addresses whose all groups are in _resolved_groups
+_prefetched_group_ips = set()
+# number of projects or groups requested in one page when prefetching
+PREFETCH_PAGE_SIZE = 500
+# number of items requested in one page of gitlab list API, 100 is the maximum of gitlab
+GITLAB_PAGE_SIZE = 100
+# number of gitlab pages requested concurrently when total pages is known
+GITLAB_PAGE_WORKERS = 4
 
 
 # create a project in gerrit which name is group name in gitlab
@@ -27,42 +52,37 @@ def create_parent_project_in_gerrit(gerrit_ip, parent_project_name, group_owner,
     admin_group_name = 'Administrators'
 
     # find 'Administrators' group id in gerrit
-    admin_group_finding_response = find_group_in_gerrit(gerrit_ip, admin_group_name)
-    admin_group_id = json.loads(admin_group_finding_response)[0]['group_id']
+    admin_group_id = find_group_info_in_gerrit(gerrit_ip, admin_group_name)['group_id']
 
     # find project in gerrit
     # create project when the response is empty
-    find_parent_project_response = find_project_in_gerrit(gerrit_ip, parent_project_name)
-    if len(json.loads(find_parent_project_response)) != 0:
-        print('Parent project' + parent_project_name + ' already existed.')
-    # some parent_project_name contains '/' which means this 'parent project' is a 'child project' actually
-    # when create this project, set project name in front of '/' as parent in json data used in http request data
-    elif '/' in parent_project_name:
-        actual_parent = parent_project_name.split('/')[0]
-        parent_project_name = parent_project_name.replace('/', '%2F')
-        # create project
-        http_session = create_access_session(gerrit_ip)
-        http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/' + parent_project_name,
-        json={
-            "parent": actual_parent,
-            "description": parent_project_description,
-            "owners": [admin_group_id],
-            "permission_only": True
-        })
-        create_access_rights_in_parent(gerrit_ip, parent_project_name, group_owner, access_rights_json_full_path)
+    if project_existed_in_gerrit(gerrit_ip, parent_project_name):
+        print('Parent project ' + parent_project_name + ' already existed, apply its access rights.')
     else:
-        http_session = create_access_session(gerrit_ip)
-        http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/' + parent_project_name,
-        json={
+        project_data = {
             "description": parent_project_description,
             "owners": [admin_group_id],
             "permission_only": True
-        })
-        create_access_rights_in_parent(gerrit_ip, parent_project_name, group_owner, access_rights_json_full_path)
+        }
+        # some parent_project_name contains '/' which means this 'parent project' is a 'child project' actually
+        # when create this project, set project name in front of '/' as parent in json data used in http request data
+        if '/' in parent_project_name:
+            project_data['parent'] = parent_project_name.split('/')[0]
+        # create project
+        http_session = create_access_session(gerrit_ip)
+        project_create_response = http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/'
+        + parent_project_name.replace('/', '%2F'), json=project_data)
+        # 409 means project was created by a migration crashed before its access rights were applied
+        if project_create_response.status_code not in (201, 409):
+            raise ValueError('Create parent project ' + parent_project_name + ' failed: '
+                             + str(project_create_response.status_code) + ' ' + project_create_response.text.strip())
+        remember_project_in_gerrit(gerrit_ip, parent_project_name)
+    # team group is found if it existed and rules of template are added again, so applying them twice changes nothing
+    create_access_rights_in_parent(gerrit_ip, parent_project_name, group_owner, access_rights_json_full_path)
 
 
 # create project in gerrit with given project name
-def create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project_name, project_admin):
+def create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project_name, project_admin, admin_group_id=None):
     """
     create project with given project name in gerrit as well as group which contains administrators of new project
     :param gerrit_ip: gerrit ip address
@@ -70,6 +90,7 @@ def create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project_n
     :param group_name: name of group
     :param project_name: name of project
     :param project_admin: admin username of project
+    :param admin_group_id: id of admin group created by create_admin_groups_in_order, found or created if it's None
     """
     # create session for http request
     http_session = create_access_session(gerrit_ip)
@@ -81,47 +102,36 @@ def create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project_n
 
     new_project_name = group_name + '/' + project_name
     # find id of new project's admin group in gerrit
-    admin_group_id = create_group_all_admins(gerrit_ip, group_name, project_admin)
+    if admin_group_id is None:
+        admin_group_id = create_admin_groups_in_order(gerrit_ip, group_name, project_admin)
     if '/' in new_project_name:
         new_project_name = new_project_name.replace('/', '%2F')
     
-    http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/' + new_project_name, 
-    json={
+    project_create_response = http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/'
+    + new_project_name, json={
         "parent": group_name,
         "owners": [admin_group_id]
     })
+    if project_create_response.status_code not in (201, 409):
+        raise ValueError('Create project ' + group_name + '/' + project_name + ' failed: '
+                         + str(project_create_response.status_code) + ' ' + project_create_response.text.strip())
+    remember_project_in_gerrit(gerrit_ip, group_name + '/' + project_name)
     print('Project ' + group_name + '/' + project_name + ' created in gerrit.\n')
 
 
-# iterate projects list and create project to given group in gerrit
-def create_separate_project_in_gerrit(gerrit_ip, group_name, project_admin, projects_list):
+# create admin group of given group and admin group of its parent group
+# admin group of parent group must exist before admin group of subgroup is added to it
+def create_admin_groups_in_order(gerrit_ip, group_name, project_admin):
     """
-    parse projects list and create project in projects_list in gerrit
     :param gerrit_ip: gerrit ip address
-    :param group_name: name of group
+    :param group_name: group name, it's 'parent/subgroup' for subgroup
     :param project_admin: admin username of project
-    :param projects_list: a list contains all projects need to create in gerrit
+    :return: admin_group_id: id of admin group of given group
     """
-    parent_group_name = ''
-    # convert projects_list from string representation of list to list
-    projects_list = projects_list.strip('][').split(', ')
-
-    # iterate in projects_list
-    for project in projects_list:
-        project_full_name = group_name + '/' + project
-        # check project in gerrit
-        project_finding_response = find_project_in_gerrit(gerrit_ip, project_full_name)
-        if len(json.loads(project_finding_response)) != 0:
-            # project already existed
-            print(project_full_name + ' is already existed.')
-        else:
-            # project not found
-            print('Creating ' + project_full_name + ' in gerrit.')
-            if '/' in group_name:
-                parent_group_name = group_name.split('/')[0]
-                group_name = group_name.split('/')[1]
-                # create project
-                create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project, project_admin)
+    if '/' in group_name:
+        create_group_all_admins(gerrit_ip, group_name.split('/')[0], project_admin)
+
+    return create_group_all_admins(gerrit_ip, group_name, project_admin)
 
 
 # create access rights in gerrit
@@ -138,27 +148,56 @@ def create_access_rights_in_parent(gerrit_ip, parent_project_name, group_owner,
 
     # find UUID of 'Service Users' group in gerrit
     service_users_group_name = 'Service Users'
-    service_users_group_id = json.loads(find_group_in_gerrit(gerrit_ip, service_users_group_name))[0]['id']
+    service_users_group_id = find_group_info_in_gerrit(gerrit_ip, service_users_group_name)['id']
 
-    # replace access rights file content
-    # use massedit to replace some stable values to group UUID
+    # replace some stable values of template to group UUID in memory, template file is never changed
     # template json loadted in template_json directory
-    source_json = [access_rights_json_full_path]
-    massedit.edit_files(source_json, ["re.sub('Team-Group-UUID', '" + parent_group_id + "', line)"], dry_run=False)
-    massedit.edit_files(source_json, ["re.sub('Service-Users-UUID', '" + service_users_group_id + "', line)"], dry_run=False)
-    # read json with changed values of group UUID
-    with open(access_rights_json_full_path, encoding='utf-8') as f:
-        data = json.loads(f.read())
+    data = render_access_rights_template(load_access_rights_template(access_rights_json_full_path),
+                                         {'Team-Group-UUID': parent_group_id,
+                                          'Service-Users-UUID': service_users_group_id})
     # set access right with json data
     session = create_access_session(gerrit_ip)
     if '/' in parent_project_name:
         parent_project_name = parent_project_name.replace('/', '%2F')
-    access_set_response = session.post('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/' + parent_project_name + '/access', 
-    json=data).text.replace(')]}\'', '')
-    project_access_revision = json.loads(access_set_response)["revision"]
+    access_set_response = decode_json_response(session.post('http://' + gerrit_ip + ':' + gerrit_port + '/a/projects/'
+    + parent_project_name + '/access', json=data))
+    project_access_revision = access_set_response["revision"]
     print('Access rights rights applied. The revision of access right is ' + project_access_revision)
 
 
+# read and parse access rights template json file only once
+# returned template is shared by all parent projects, it must not be changed
+@lru_cache(maxsize=None)
+def load_access_rights_template(access_rights_json_full_path):
+    """
+    :param access_rights_json_full_path: full path of access rights template json file
+    :return: access_rights_template: parsed json of template
+    """
+    with open(access_rights_json_full_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# render new access rights json of template with placeholders replaced
+def render_access_rights_template(access_rights_template, placeholder_values):
+    """
+    placeholders are replaced in both keys and string values, like group UUID used as key of rules
+    :param access_rights_template: parsed json of template
+    :param placeholder_values: {placeholder: value}, like {'Team-Group-UUID': UUID of group}
+    :return: access_rights: new json, template is not changed
+    """
+    if isinstance(access_rights_template, dict):
+        return {render_access_rights_template(key, placeholder_values):
+                render_access_rights_template(value, placeholder_values)
+                for key, value in access_rights_template.items()}
+    if isinstance(access_rights_template, list):
+        return [render_access_rights_template(value, placeholder_values) for value in access_rights_template]
+    if isinstance(access_rights_template, str):
+        for placeholder, value in placeholder_values.items():
+            access_rights_template = access_rights_template.replace(placeholder, value)
+
+    return access_rights_template
+
+
 # create group that contains all members of project
 def create_group_all_members(gerrit_ip, parent_project_name, group_owner):
     """
@@ -179,18 +218,21 @@ def create_group_all_members(gerrit_ip, parent_project_name, group_owner):
     group_description = 'All members of ' + parent_project_name + ' team.'
 
     # check group
-    find_group_response = find_group_in_gerrit(gerrit_ip, group_name)
-    if len(json.loads(find_group_response)) != 0:
+    group_info = find_group_info_in_gerrit(gerrit_ip, group_name)
+    if group_info is not None:
         # group exist, find its id
-        group_id = json.loads(find_group_response)[0]['id']
+        group_id = group_info['id']
     else:
         # group not found, create this group
         session = create_access_session(gerrit_ip)
+        new_group_name = group_name
         if '/' in parent_project_name:
-            group_name = group_name.replace('/', '%2F')
-        create_group_response = session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/' + group_name, 
-        json={"description": group_description, "members": [group_owner_id]}).text.replace(')]}\'', '')
-        group_id = json.loads(create_group_response)['id']
+            new_group_name = group_name.replace('/', '%2F')
+        group_info = decode_json_response(session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/'
+        + new_group_name, json={"description": group_description, "members": [group_owner_id]}))
+        group_id = group_info['id']
+        # new group is resolved, later lookups don't need to request gerrit
+        remember_group_in_gerrit(gerrit_ip, group_name, group_info)
         # add 'Administrator' account to new group
         gerrit_admin_username = set_admin_username_n_http_cred(gerrit_ip)[0]
         gerrit_admin_id = find_user_id_in_gerrit(gerrit_ip, gerrit_admin_username)
@@ -208,8 +250,8 @@ def create_group_all_admins(gerrit_ip, group_name, member_name):
     :param member_name: one member of new admin group
     :return: group_id: new admin group id
     """
-    # admin group name
-    admin_group_name = 'Group' + group_name + ' Administrators'
+    # admin group name, it must be the same as the name used to find parent administrators group below
+    admin_group_name = get_admin_group_name(group_name)
     # gerrit port
     gerrit_port = set_gerrit_port(gerrit_ip)
     # find member id of given member name
@@ -217,61 +259,163 @@ def create_group_all_admins(gerrit_ip, group_name, member_name):
     # http session
     http_session = create_access_session(gerrit_ip)
 
-    admin_group_finding_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/?query=name:"' 
-    + admin_group_name + '"').text.replace(')]}\'','')
+    admin_group_info = find_group_info_in_gerrit(gerrit_ip, admin_group_name)
     
-    if len(json.loads(admin_group_finding_response)) != 0:
+    if admin_group_info is not None:
         # group already existed
         print('Group ' + admin_group_name + ' already existed, find its id.')
-        group_id = json.loads(admin_group_finding_response)[0]['id']
+        group_id = admin_group_info['id']
     else:
         # group not found, create one
         print('Create group ' + admin_group_name + ' in gerrit.')
+        admin_group_key = admin_group_name
         # convert ' ' and '/' to '%20' and '%2F' for http request
         if '/' in admin_group_name:
             admin_group_name = admin_group_name.replace('/', '%2F')
         if ' ' in admin_group_name:
             admin_group_name = admin_group_name.replace(' ', '%20')
         
-        group_creating_response = http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/' + admin_group_name, 
-        json={
+        admin_group_info = decode_json_response(http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/'
+        + admin_group_name, json={
             "description": "Administrators for " + admin_group_name + " group.",
             "members": [member_id]
-        }).text.replace(')]}\'', '')
-        group_id = json.loads(group_creating_response)['id']
+        }))
+        group_id = admin_group_info['id']
+        # new group is resolved, later lookups don't need to request gerrit
+        remember_group_in_gerrit(gerrit_ip, admin_group_key, admin_group_info)
     
     # when use above code create group which name contains '/', the subgroup not in parent group 
     # set subgroup under its parent group
     if '/' in group_name:
         # find parent administrators group id
-        parent_admin_group_name = 'Group ' + group_name.split('/')[0] + ' Administrators'
-        parent_admin_group_finding_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port 
-        + '/a/groups/?query=name:"' + parent_admin_group_name + '"').text.replace(')]}\'', '')
-        parent_admin_group_id = json.loads(parent_admin_group_finding_response)[0]['id']
+        parent_admin_group_name = get_admin_group_name(group_name.split('/')[0])
+        parent_admin_group_id = find_group_info_in_gerrit(gerrit_ip, parent_admin_group_name)['id']
         # create subgroup under parent group
         http_session.put('http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/' + parent_admin_group_id + '/groups/' + group_id)
     
     return group_id
 
 
-# check project create parameter
-def check_project_create_para(gitlab_ip, gerrit_ip, group_name, project_admin, project_create_para):
+# name of group that contains all administrators of projects under given group
+def get_admin_group_name(group_name):
+    """
+    :param group_name: group name, it's 'parent/subgroup' for subgroup
+    :return: admin_group_name: name of admin group
+    """
+    return 'Group ' + group_name + ' Administrators'
+
+
+# read gitlab and gerrit state in bulk and plan what need to create in gerrit
+# entities already existed in gerrit are not in plan, so migrating again only creates what is missing
+# project stage is a generator, next page of gitlab is requested while projects of previous pages are being created
+def plan_migration(gitlab_ip, gerrit_ip, group_name, project_create_para, journal=None):
     """
-    check project create parameter(all or separate projects list) and revoke different methods
     :param gitlab_ip: gitlab ip address
     :param gerrit_ip: gerrit ip address
     :param group_name: name of group
-    :param project_admin: admin username of project
     :param project_create_para: all or a list contains all projects need to create in gerrit
+    :param journal: MigrationJournal of this migration, parent project step is planned until it's recorded in it
+    :return: migration_plan: list of stages in dependency order, steps in one stage can run concurrently,
+             the last stage is a generator of project steps and can be iterated only once
     """
+    # existing projects and groups are listed once instead of checking them one by one
+    prefetch_gerrit_entities(gerrit_ip, group_name)
+    parent_group_name = ''
+    sub_group_name = group_name
+    if '/' in group_name:
+        parent_group_name, sub_group_name = group_name.split('/')[0], group_name.split('/')[1]
+
+    # parent project with its team group and access rights
+    # existed parent project may be created by a migration crashed before its access rights were applied,
+    # so only journal tells whether this step completed
+    parent_project_stage = []
+    if journal is None or not journal.is_completed('create_parent_project:' + group_name):
+        parent_project_stage.append({'action': 'create_parent_project', 'name': group_name,
+                                     'existed': project_existed_in_gerrit(gerrit_ip, group_name)})
+    # admin group of parent group must exist before admin group of subgroup is added to it
+    parent_admin_group_stage = []
+    if parent_group_name != '' and find_group_info_in_gerrit(gerrit_ip, get_admin_group_name(parent_group_name)) is None:
+        parent_admin_group_stage.append({'action': 'create_admin_group', 'name': parent_group_name})
+    admin_group_stage = []
+    if find_group_info_in_gerrit(gerrit_ip, get_admin_group_name(group_name)) is None:
+        admin_group_stage.append({'action': 'create_admin_group', 'name': group_name})
+
     if project_create_para == 'all':
-        # create all projects with given gitlab group in gerrit
-        total_created_project = find_project_in_gitlab(gitlab_ip, gerrit_ip, group_name, project_admin)
-        print('Total number of created projects is: ' + str(total_created_project))
+        # all projects with given gitlab group
+        project_names = iter_projects_in_gitlab(gitlab_ip, find_group_in_gitlab(gitlab_ip, sub_group_name))
     else:
-        # create separate projects
         # pattern of project_create_para is ['proj_a', 'proj_b', ...]
-        create_separate_project_in_gerrit(gerrit_ip, group_name, project_admin, project_create_para)
+        project_names = project_create_para.strip('][').split(', ')
+    project_stage = ({'action': 'create_project', 'name': group_name + '/' + project_name,
+                      'parent_group_name': parent_group_name, 'group_name': sub_group_name, 'project_name': project_name}
+                     for project_name in project_names
+                     if not project_existed_in_gerrit(gerrit_ip, group_name + '/' + project_name))
+
+    return [stage for stage in (parent_project_stage, parent_admin_group_stage, admin_group_stage) if stage] + [project_stage]
+
+
+# print steps of migration plan, all projects are listed from gitlab before anything is printed
+def print_migration_plan(migration_plan):
+    """
+    :param migration_plan: plan created by plan_migration, it can't be applied after printed
+    """
+    migration_plan = [list(stage) for stage in migration_plan]
+    migration_plan = [stage for stage in migration_plan if stage]
+    if not migration_plan:
+        print('Nothing to create, all projects and groups already existed in gerrit.')
+    for stage_index, stage in enumerate(migration_plan):
+        print('Stage ' + str(stage_index + 1) + ':')
+        for step in stage:
+            if step['action'] == 'create_parent_project' and step['existed']:
+                print('  apply access rights of existed parent project ' + step['name'])
+            elif step['action'] == 'create_parent_project':
+                print('  create parent project ' + step['name'] + ' with its team group and access rights')
+            elif step['action'] == 'create_admin_group':
+                print('  create group ' + get_admin_group_name(step['name']))
+            else:
+                print('  create project ' + step['name'])
+
+
+# apply migration plan stage by stage, steps in one stage run concurrently
+# completed steps are recorded in journal, steps completed by a crashed migration are skipped
+def apply_migration_plan(gerrit_ip, migration_plan, project_admin, access_rights_json_full_path, max_workers=1,
+                         journal=None):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param migration_plan: plan created by plan_migration
+    :param project_admin: admin username of project
+    :param access_rights_json_full_path: full path of access rights template json file
+    :param max_workers: number of steps run concurrently
+    :param journal: MigrationJournal of this migration, None to not record steps
+    """
+    if journal is None:
+        journal = MigrationJournal()
+
+    def apply_step(step):
+        step_key = step['action'] + ':' + step['name']
+        if journal.is_completed(step_key):
+            print('Step ' + step_key + ' completed before, skip.')
+            return False
+        step_result = None
+        if step['action'] == 'create_parent_project':
+            create_parent_project_in_gerrit(gerrit_ip, step['name'], project_admin, access_rights_json_full_path)
+        elif step['action'] == 'create_admin_group':
+            step_result = create_group_all_admins(gerrit_ip, step['name'], project_admin)
+        else:
+            full_group_name = step['name'].rsplit('/', 1)[0]
+            # admin group is resolved in previous stage or existed before, it's found without request
+            admin_group_id = find_group_info_in_gerrit(gerrit_ip, get_admin_group_name(full_group_name))['id']
+            create_project_in_gerrit(gerrit_ip, step['parent_group_name'], step['group_name'], step['project_name'],
+                                     project_admin, admin_group_id)
+        journal.record(step_key, step_result)
+        return step['action'] == 'create_project'
+
+    # steps of project stage are planned while former steps are being applied
+    created_project_count = 0
+    for stage in migration_plan:
+        for project_created in map_in_order(apply_step, stage, max_workers):
+            created_project_count += project_created
+    print('Total number of created projects is: ' + str(created_project_count))
 
 
 # find user id in gerrit
@@ -282,11 +426,20 @@ def find_user_id_in_gerrit(gerrit_ip, member_name):
     :param member_name: account name in gerrit 
     :return: account_id: account id of given member_name
     """
+    # every account is requested only once
+    with _resolved_entities_lock:
+        account_id = _resolved_account_ids.get(gerrit_ip, {}).get(member_name)
+    if account_id is not None:
+        return account_id
+
     gerrit_port = set_gerrit_port(gerrit_ip)
     http_session = create_access_session(gerrit_ip)
     # request for user via gerrit REST API
-    user_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port + '/accounts/' + member_name).text.replace(')]}\'', '')
-    account_id = json.loads(user_response)['_account_id']
+    user_response = decode_json_response(http_session.get('http://' + gerrit_ip + ':' + gerrit_port + '/accounts/'
+    + member_name))
+    account_id = user_response['_account_id']
+    with _resolved_entities_lock:
+        _resolved_account_ids.setdefault(gerrit_ip, {})[member_name] = account_id
     return account_id
 
 
@@ -296,19 +449,154 @@ def find_group_in_gerrit(gerrit_ip, group_name):
     return http response of group request via gerrit REST API
     :param gerrit_ip: gerrit ip address
     :param group_name: name of group to find in gerrit
-    :return: find_group_response: response text after request via gerrit REST API
+    :return: find_group_response: response json after request via gerrit REST API
     """
     gerrit_port = set_gerrit_port(gerrit_ip)
     # create http access session in gerrit
     http_session = create_access_session(gerrit_ip)
     # request via gerrit API
-    # in 3.x gerrit, at the beginning of response text contains ')]}', should remove them with string.replace
-    find_group_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port 
-    + '/a/groups/?query=name:"' + group_name + '"').text.replace(')]}\'', '')
+    # in 3.x gerrit, at the beginning of response text contains ')]}', it's removed in decode_json_response
+    find_group_response = decode_json_response(http_session.get('http://' + gerrit_ip + ':' + gerrit_port
+    + '/a/groups/?query=name:"' + group_name + '"'))
 
     return find_group_response
 
 
+# find group info in gerrit with given group name
+# every group is requested only once, groups not found are requested again because they may be created later
+def find_group_info_in_gerrit(gerrit_ip, group_name):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param group_name: name of group to find in gerrit
+    :return: group_info: first group info in response, None if group not found
+    """
+    with _resolved_entities_lock:
+        group_info = _resolved_groups.get(gerrit_ip, {}).get(unquote(group_name))
+    # all groups are prefetched, group not in cache doesn't exist
+    if group_info is None and gerrit_ip in _prefetched_group_ips:
+        return None
+    if group_info is None:
+        find_group_response = find_group_in_gerrit(gerrit_ip, group_name)
+        if len(find_group_response) == 0:
+            return None
+        group_info = find_group_response[0]
+        remember_group_in_gerrit(gerrit_ip, group_name, group_info)
+
+    return group_info
+
+
+# save resolved group info, it's also called when a new group created
+def remember_group_in_gerrit(gerrit_ip, group_name, group_info):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param group_name: name of group, '%20' in it is the same as ' '
+    :param group_info: group info returned by gerrit REST API
+    """
+    with _resolved_entities_lock:
+        _resolved_groups.setdefault(gerrit_ip, {})[unquote(group_name)] = group_info
+
+
+# load resolved accounts saved by last migration
+# groups are not loaded, all of them are listed by prefetch_gerrit_entities before they're used
+def load_resolved_entities(entities_json_full_path):
+    """
+    :param entities_json_full_path: full path of json file saved by save_resolved_entities
+    """
+    if not os.path.exists(entities_json_full_path):
+        return
+    with open(entities_json_full_path, encoding='utf-8') as f:
+        resolved_entities = json.load(f)
+    with _resolved_entities_lock:
+        for gerrit_ip, account_ids in resolved_entities.get('accounts', {}).items():
+            _resolved_account_ids.setdefault(gerrit_ip, {}).update(account_ids)
+
+
+# save resolved accounts, so next migration doesn't need to request them again
+def save_resolved_entities(entities_json_full_path):
+    """
+    :param entities_json_full_path: full path of json file
+    """
+    with _resolved_entities_lock:
+        resolved_entities = {'accounts': _resolved_account_ids}
+        with open(entities_json_full_path, 'w', encoding='utf-8') as f:
+            json.dump(resolved_entities, f, indent=4, sort_keys=True)
+
+
+# list all groups and projects under given prefix in gerrit with a few paged requests
+# after that, checking whether group or project existed doesn't need to request gerrit
+def prefetch_gerrit_entities(gerrit_ip, project_prefix):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param project_prefix: prefix of project names, like group name in gitlab
+    """
+    gerrit_port = set_gerrit_port(gerrit_ip)
+    http_session = create_access_session(gerrit_ip)
+
+    # list projects whose name start with prefix(https://gerrit-review.googlesource.com/Documentation/rest-api-projects.html#list-projects)
+    project_names = set()
+    for projects_page in iter_gerrit_list_pages(http_session, 'http://' + gerrit_ip + ':' + gerrit_port
+                                                + '/a/projects/', {'p': project_prefix}):
+        project_names.update(projects_page.keys())
+    # list all groups(https://gerrit-review.googlesource.com/Documentation/rest-api-groups.html#list-groups)
+    groups = {}
+    for groups_page in iter_gerrit_list_pages(http_session, 'http://' + gerrit_ip + ':' + gerrit_port + '/a/groups/', {}):
+        groups.update(groups_page)
+
+    with _resolved_entities_lock:
+        _existing_projects[gerrit_ip] = project_names
+        _prefetched_project_prefixes[gerrit_ip] = project_prefix
+        # prefetch lists all groups, groups loaded from disk but deleted or renamed in gerrit are dropped
+        _resolved_groups[gerrit_ip] = groups
+        _prefetched_group_ips.add(gerrit_ip)
+    print('Prefetched ' + str(len(project_names)) + ' projects under ' + project_prefix + ' and '
+          + str(len(groups)) + ' groups in gerrit.')
+
+
+# request paged gerrit list API until the last page
+def iter_gerrit_list_pages(http_session, list_url, params):
+    """
+    :param http_session: session of gerrit
+    :param list_url: url of list API, its response is a map of name to entity info
+    :param params: query parameters of request besides paging parameters
+    :return: generator of response json of every page
+    """
+    skip = 0
+    while True:
+        page_params = dict(params, n=PREFETCH_PAGE_SIZE, S=skip)
+        list_response = decode_json_response(http_session.get(list_url, params=page_params))
+        yield list_response
+        if len(list_response) < PREFETCH_PAGE_SIZE:
+            break
+        skip += PREFETCH_PAGE_SIZE
+
+
+# check whether project existed in gerrit
+# projects under prefetched prefix are checked locally, others are requested via gerrit REST API
+def project_existed_in_gerrit(gerrit_ip, project_name):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param project_name: name of project, it's not url encoded
+    :return: True if project existed
+    """
+    with _resolved_entities_lock:
+        project_prefix = _prefetched_project_prefixes.get(gerrit_ip)
+        if project_prefix is not None and project_name.startswith(project_prefix):
+            return project_name in _existing_projects[gerrit_ip]
+
+    return len(find_project_in_gerrit(gerrit_ip, project_name)) != 0
+
+
+# save project created in gerrit, so it's regarded as existed without requesting gerrit
+def remember_project_in_gerrit(gerrit_ip, project_name):
+    """
+    :param gerrit_ip: gerrit ip address
+    :param project_name: name of project, it's not url encoded
+    """
+    with _resolved_entities_lock:
+        if gerrit_ip in _existing_projects:
+            _existing_projects[gerrit_ip].add(project_name)
+
+
 # find group in gitlab
 def find_group_in_gitlab(gitlab_ip, group_name):
     """
@@ -320,10 +608,10 @@ def find_group_in_gitlab(gitlab_ip, group_name):
     # set gitlab access token
     gitlab_access_token = set_access_token_gitlab(gitlab_ip)
     # request via gitlab REST API
-    group_finding_response = requests.get('http://' + gitlab_ip + '/api/v4/groups?private_token=' + gitlab_access_token 
-    + '&search=' + group_name).text
-    # get group id from response text
-    group_id = json.loads(group_finding_response)[0]["id"]
+    group_finding_response = decode_json_response(get_session(gitlab_ip).get('http://' + gitlab_ip
+    + '/api/v4/groups?private_token=' + gitlab_access_token + '&search=' + group_name))
+    # get group id from response json
+    group_id = group_finding_response[0]["id"]
 
     return group_id
 
@@ -333,72 +621,74 @@ def find_project_in_gerrit(gerrit_ip, project_name):
     return response of project with given project name
     :param gerrit_ip: gerrit ip address
     :param project_name: name of project to find in gerrit
-    :return: find_project_response: response text after request via gerrit REST API
+    :return: find_project_response: response json after request via gerrit REST API
     """
     gerrit_port = set_gerrit_port(gerrit_ip)
     http_session = create_access_session(gerrit_ip)
     # convert '/' to '%2F' which project name with '/'
     if '/' in project_name:
         project_name = project_name.replace('/', '%2F')
-    find_project_response = http_session.get('http://' + gerrit_ip + ':' + gerrit_port 
-    + '/a/projects/?query=name:"' + project_name + '"').text.replace(')]}\'', '')
+    find_project_response = decode_json_response(http_session.get('http://' + gerrit_ip + ':' + gerrit_port
+    + '/a/projects/?query=name:"' + project_name + '"'))
 
     return find_project_response
 
-# find project in gitlab
-def find_project_in_gitlab(gitlab_ip, gerrit_ip, group_name, project_admin):
+
+# iterate names of projects under given group in gitlab page by page
+def iter_projects_in_gitlab(gitlab_ip, group_id):
     """
-    find projects under given group in gitlab then create them in gerrit
     :param gitlab_ip: gitlab ip address
-    :param gerrit_ip: gerrit ip address
-    :param group_name: group in gitlab
-    :param project_admin: admin of project
-    :return: count: number of created projects
+    :param group_id: id of group in gitlab
+    :return: generator of project names
     """
-    # some project name contains '/', split this and first part of it is parent group name in gitlab
-    # another is the subgroup name in gitlab
-    parent_group_name = ''
-    if '/' in group_name:
-        parent_group_name = group_name.split('/')[0]
-        group_name = group_name.split('/')[1]
-    # use group name to find group id in gitlab
-    group_id = find_group_in_gitlab(gitlab_ip, group_name)
-    # gitlab access token
-    gitlab_access_token = set_access_token_gitlab(gitlab_ip)
+    for project in iter_gitlab_list(gitlab_ip, 'groups/' + str(group_id) + '/projects'):
+        yield project['name']
+
+
+# iterate all items of paged gitlab list API(https://docs.gitlab.com/ee/api/rest/#pagination)
+# items are yielded as soon as their page arrived, so callers can handle them while later pages are requested
+def iter_gitlab_list(gitlab_ip, api_path, params=None, max_workers=GITLAB_PAGE_WORKERS):
+    """
+    :param gitlab_ip: gitlab ip address
+    :param api_path: path of list API under /api/v4/, like 'groups/1/projects'
+    :param params: query parameters of list API, like {'search': project_name}
+    :param max_workers: number of pages requested concurrently when total pages is known
+    :return: generator of items in all pages
+    """
+    session = get_session(gitlab_ip)
+    list_url = 'http://' + gitlab_ip + '/api/v4/' + api_path
+    list_params = dict(params or {}, private_token=set_access_token_gitlab(gitlab_ip), per_page=GITLAB_PAGE_SIZE)
+
+    list_response = session.get(list_url, params=list_params)
+    yield from decode_json_response(list_response)
+    total_pages = list_response.headers.get('X-Total-Pages')
+    if total_pages:
+        # offset pagination with known total pages, request remaining pages concurrently and keep order of pages
+        def request_page(page):
+            return decode_json_response(session.get(list_url, params=dict(list_params, page=page)))
+
+        for page_items in map_in_order(request_page, range(2, int(total_pages) + 1), max_workers):
+            yield from page_items
+    else:
+        # gitlab omits total pages for more than 10,000 items, follow 'next' link one by one
+        next_url = list_response.links.get('next', {}).get('url')
+        while next_url:
+            list_response = session.get(next_url)
+            yield from decode_json_response(list_response)
+            next_url = list_response.links.get('next', {}).get('url')
 
-    page = 1
-    count = 0
-    while True:
-        # one page have 20 results aka projects, so set page when projects count is more than 20
-        projects_under_group_response = requests.get('http://' + gitlab_ip + '/api/v4/groups/' + str(group_id) 
-        + 'projects?private_token=' + gitlab_access_token + '&page=' + str(page)).text
-        # exit when response json is not valid
-        if not json.loads(projects_under_group_response):
-            break
-        # iterate project and create project in gerrit
-        for i in range(len(json.loads(projects_under_group_response))):
-            project_name = json.loads(projects_under_group_response)[i]['name']
-            print('Project ' + project_name + ' is under ' + group_name + ' of gitlab.')
-            create_project_in_gerrit(gerrit_ip, parent_group_name, group_name, project_name, project_admin)
-            count += 1
-        page += 1
-
-    return count
-    
 
-# create http access session in gerrit
+# get http access session in gerrit
 def create_access_session(gerrit_ip):
     """
-    create http access session for http request in gerrit
+    get pooled http access session for http request in gerrit, the same session is shared by all requests of gerrit
     :param gerrit_ip: gerrit ip address
     :return: session: a session to request with gerrit admin username and http credential
     """
     # set admin username and http credential in gerrit with different gerrit instances
     gerrit_admin_username, gerrit_admin_http_cred = set_admin_username_n_http_cred(gerrit_ip)
-    # create session
-    session = requests.Session()
-    session.auth = (gerrit_admin_username, gerrit_admin_http_cred)
-    return session
+    # get pooled session which keeps connections alive
+    return get_session(gerrit_ip, (gerrit_admin_username, gerrit_admin_http_cred))
 
 
 # in my use case, gerrit always have diffenent ports after deployed
@@ -454,14 +744,54 @@ def set_admin_username_n_http_cred(gerrit_ip):
     return admin_user_name, admin_http_cred
 
 
-"""
-:parameter
-sys.argv[1]: gitlab(source) instance ip address
-sys.argv[2]: gerrit(target) instance ip address
-sys.argv[3]: group name of gitlab
-sys.argv[4]: username of admin group in gerrit
-sys.argv[5]: access rights template json file full path
-sys.argv[6]: create projects option: all or separated projects
-"""
-create_parent_project_in_gerrit(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
-check_project_create_para(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[6])
+# parse command line arguments
+def parse_arguments():
+    """
+    :return: parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Migrate repositories only from GitLab to Gerrit.')
+    parser.add_argument('gitlab_ip', help='gitlab(source) instance ip address')
+    parser.add_argument('gerrit_ip', help='gerrit(target) instance ip address')
+    parser.add_argument('group_name', help='group name of gitlab')
+    parser.add_argument('project_admin', help='username of admin group in gerrit')
+    parser.add_argument('access_rights_json_full_path', help='access rights template json file full path')
+    parser.add_argument('project_create_para', help='create projects option: all or separated projects')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of projects created concurrently, default is 1')
+    parser.add_argument('--entities-cache',
+                        help='json file full path to keep resolved gerrit accounts between migrations')
+    parser.add_argument('--dry-run', action='store_true', help='only print what will be created in gerrit')
+    parser.add_argument('--journal', help='journal file full path, completed steps are recorded in it and skipped '
+                        'when migration is started again')
+
+    return parser.parse_args()
+
+
+# entry point of command line
+def main():
+    """
+    plan creating projects of gitlab group in gerrit, then apply the plan or only print it with --dry-run
+    """
+    arguments = parse_arguments()
+    # every worker thread needs its own connection
+    if arguments.workers > http_client.POOL_SIZE:
+        http_client.configure_http_client(pool_size=arguments.workers)
+    if arguments.entities_cache is not None:
+        load_resolved_entities(arguments.entities_cache)
+    migration_journal = MigrationJournal(arguments.journal)
+    migration_plan = plan_migration(arguments.gitlab_ip, arguments.gerrit_ip, arguments.group_name,
+                                    arguments.project_create_para, migration_journal)
+    # only dry run lists all projects before anything is created
+    if arguments.dry_run:
+        print_migration_plan(migration_plan)
+    else:
+        apply_migration_plan(arguments.gerrit_ip, migration_plan, arguments.project_admin,
+                             arguments.access_rights_json_full_path, arguments.workers, migration_journal)
+    migration_journal.close()
+    if arguments.entities_cache is not None:
+        save_resolved_entities(arguments.entities_cache)
+
+
+# other scripts import functions from this file, only run migration when this file is executed
+if __name__ == '__main__':
+    main()
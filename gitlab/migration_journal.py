@@ -0,0 +1,95 @@
+'''
+Append-only journal of migration steps
+
+Author: s1mple-child
+
+Every completed step is appended to a JSONL file with its result, like id of created group or project.
+When a crashed migration is started again with the same journal, completed steps are skipped
+and their results are read from the journal instead of requesting gitlab or gerrit.
+'''
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class MigrationJournal:
+    """
+    record completed migration steps in a JSONL file
+    """
+    def __init__(self, journal_full_path=None):
+        """
+        :param journal_full_path: full path of journal file, steps are only kept in memory if it's None
+        """
+        self.journal_full_path = journal_full_path
+        self.completed_steps = {}
+        self._journal_lock = threading.Lock()
+        self._journal_file = None
+        if journal_full_path is None:
+            return
+        if os.path.exists(journal_full_path):
+            with open(journal_full_path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        journal_record = json.loads(line)
+                    except ValueError:
+                        # the last line may be written partly when script crashed, this step is done again
+                        continue
+                    self.completed_steps[journal_record['step']] = journal_record.get('result')
+            print('Journal ' + journal_full_path + ' loaded, ' + str(len(self.completed_steps)) + ' steps completed before.')
+            truncate_partial_last_line(journal_full_path)
+        self._journal_file = open(journal_full_path, 'a', encoding='utf-8')
+
+    def is_completed(self, step_key):
+        """
+        :param step_key: key of step, like 'create_project:group/project'
+        :return: True if step completed in this or previous migration
+        """
+        with self._journal_lock:
+            return step_key in self.completed_steps
+
+    def get_result(self, step_key):
+        """
+        :param step_key: key of step
+        :return: result recorded with step, None if step not completed
+        """
+        with self._journal_lock:
+            return self.completed_steps.get(step_key)
+
+    def record(self, step_key, result=None):
+        """
+        append completed step to journal file, it's flushed to disk before return
+        :param step_key: key of step
+        :param result: json serializable result of step, like id of created entity
+        """
+        journal_line = json.dumps({'step': step_key, 'result': result,
+                                   'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        with self._journal_lock:
+            self.completed_steps[step_key] = result
+            if self._journal_file is not None:
+                self._journal_file.write(journal_line + '\n')
+                self._journal_file.flush()
+                os.fsync(self._journal_file.fileno())
+
+    def close(self):
+        """
+        close journal file
+        """
+        with self._journal_lock:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+
+
+# remove the last line written partly when script crashed
+# otherwise next record is appended to that line and lost when journal is loaded again
+def truncate_partial_last_line(journal_full_path):
+    """
+    :param journal_full_path: full path of journal file
+    """
+    with open(journal_full_path, 'rb+') as f:
+        journal_content = f.read()
+        if journal_content and not journal_content.endswith(b'\n'):
+            f.truncate(journal_content.rfind(b'\n') + 1)
@@ -0,0 +1,34 @@
+'''
+Bounded worker pool shared by gerrit and gitlab scripts
+
+Author: s1mple-child
+
+Items are taken from the given iterable lazily, so a producer like paged REST API requests
+keeps running while earlier items are being handled by worker threads.
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# call function with every item in a bounded thread pool and yield results in the same order as items
+# at most max_workers * 2 items are in flight, so items are consumed lazily and memory stays bounded
+def map_in_order(function, items, max_workers):
+    """
+    :param function: function called with every item
+    :param items: iterable of items
+    :param max_workers: number of worker threads, items are handled in current thread if it is not bigger than 1
+    :return: generator of results
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending_futures = deque()
+        for item in items:
+            pending_futures.append(executor.submit(function, item))
+            if len(pending_futures) >= max_workers * 2:
+                yield pending_futures.popleft().result()
+        while pending_futures:
+            yield pending_futures.popleft().result()